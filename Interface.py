@@ -3,79 +3,632 @@
 # Interface for the assignement
 #
 
+import bisect
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import mysql.connector
+from mysql.connector import errorcode
+
+import connectionPool
+import ratingsParser
+import statementProfiler
 
 DATABASE_NAME = 'dds_assgn1'
+BATCH_SIZE = 10000
+COMMIT_INTERVAL = 100000
+# Rows held in partition buffers at once; with many partitions the largest buffer is flushed early
+MAX_BUFFERED_ROWS = 10 * BATCH_SIZE
+CHUNK_BYTES = 4 * 1024 * 1024
+CATALOG_TABLE = 'partition_meta'
+SEQUENCE_TABLE = 'partition_seq'
+HASH_COLUMNS = ('userid', 'movieid')
+RATING_TYPES = ('FLOAT', 'DECIMAL(2,1)')
+# Clustered on (userid, movieid) with secondary indexes for movie lookups and rating ranges
+INDEXED_LAYOUT = {
+    'primarykey': ('userid', 'movieid'),
+    'indexes': ('movieid', 'rating'),
+    'ratingtype': 'DECIMAL(2,1)',
+    'compressed': False
+}
+
+_catalogcache = {}
+# Connections for slot claims made inside a caller's transaction, see reserveslots
+_sequenceconnections = {}
+_sequencelock = threading.Lock()
+
+
+def getopenconnection(user=None, password=None, dbname='mysql'):
+    # Borrowed from the shared pool; close() returns it. Credentials default to the MYSQL_* env vars
+    return connectionPool.getconnection(user, password, dbname)
+
+
+def _connectionfactory(openconnection):
+    # Borrows extra connections with the caller's settings for worker threads
+    return connectionPool.poolof(openconnection).getconnection
+
+
+def _createratingstable(cur, tablename, layout=None):
+    # layout: dict with primarykey (columns), indexes (columns, added later by _buildindexes),
+    # ratingtype (one of RATING_TYPES) and compressed; None keeps the plain heap
+    layout = layout or {}
+    ratingtype = layout.get('ratingtype', 'FLOAT')
+    if ratingtype not in RATING_TYPES:
+        raise ValueError("Rating type must be one of " + ', '.join(RATING_TYPES) + ", got " + str(ratingtype))
+    columns = "userid INTEGER, movieid INTEGER, rating " + ratingtype
+    if layout.get('primarykey'):
+        # InnoDB clusters rows by the primary key, so it is declared up front; adding it later rebuilds the table
+        columns += ", PRIMARY KEY (" + ", ".join(layout['primarykey']) + ")"
+    sql = "CREATE TABLE " + tablename + " (" + columns + ")"
+    if layout.get('compressed'):
+        sql += " ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8"
+    cur.execute(sql)
+
+
+def _buildindexes(openconnection, tablenames, layout=None):
+    # Secondary indexes are built once the rows are in, which is much cheaper than maintaining them per insert
+    if not layout or not layout.get('indexes'):
+        return
+    cur = statementProfiler.cursor(openconnection)
+    for tablename in tablenames:
+        cur.execute("ALTER TABLE " + tablename + " " +
+                    ", ".join("ADD INDEX " + column + "_idx (" + column + ")" for column in layout['indexes']))
+    cur.close()
+    openconnection.commit()
+
+
+def _readbatches(ratingsfilepath, batchsize):
+    # Streams the userid::movieid::rating::timestamp file as lists of at most batchsize rows;
+    # only one batch at a time is turned into tuples, the rest of the chunk stays in typed arrays
+    for columns in ratingsParser.parsechunks(ratingsfilepath):
+        for part in ratingsParser.slices(columns, batchsize):
+            yield ratingsParser.rows(part)
+
+
+def _filechunks(ratingsfilepath, chunkbytes):
+    # Splits the file into (start, end) byte ranges that begin and end on line boundaries
+    size = os.path.getsize(ratingsfilepath)
+    with open(ratingsfilepath, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunkbytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            yield start, end
+            start = end
+
+
+def _parsechunk(args):
+    # Runs in a parser process; typed arrays are much cheaper to send back than lists of tuples
+    ratingsfilepath, start, end = args
+    return ratingsParser.parserange(ratingsfilepath, start, end)
+
+
+def _insertwriter(connectionfactory, rowqueue, batchsize, errors):
+    # Consumes (tablename, rows) items on a private connection until it sees None
+    con = None
+    try:
+        con = connectionfactory()
+        cur = statementProfiler.cursor(con)
+        while True:
+            item = rowqueue.get()
+            if item is None:
+                break
+            if errors:
+                continue
+            tablename, rows = item
+            if isinstance(rows, tuple):
+                # Parsed columns are converted one batch at a time
+                batches = (ratingsParser.rows(part) for part in ratingsParser.slices(rows, batchsize))
+            else:
+                batches = (rows[i:i + batchsize] for i in range(0, len(rows), batchsize))
+            for batch in batches:
+                cur.executemany("INSERT INTO " + tablename +
+                                " (userid, movieid, rating) VALUES (%s, %s, %s)", batch)
+            con.commit()
+        cur.close()
+    except Exception as e:
+        errors.append(e)
+        # Keep draining so the reader never blocks on a full queue
+        while rowqueue.get() is not None:
+            pass
+    finally:
+        if con is not None:
+            con.close()
+
+
+def _startwriters(connectionfactory, numberofwriters, batchsize, maxpending, shared=False, errors=None):
+    # shared=True lets all writers pull from one queue; otherwise each writer gets its own
+    errors = [] if errors is None else errors
+    if shared:
+        queues = [queue.Queue(maxsize=maxpending)] * numberofwriters
+    else:
+        queues = [queue.Queue(maxsize=maxpending) for _ in range(numberofwriters)]
+    writers = [threading.Thread(target=statementProfiler.bind(_insertwriter),
+                                args=(connectionfactory, rowqueue, batchsize, errors))
+               for rowqueue in queues]
+    for writer in writers:
+        writer.start()
+    return queues, writers, errors
+
+
+def _stopwriters(queues, writers, errors):
+    for rowqueue in queues:
+        rowqueue.put(None)
+    for writer in writers:
+        writer.join()
+    if errors:
+        raise errors[0]
+
+
+def _tablewriters(tablefactories, numberofwriters, batchsize):
+    # Starts up to numberofwriters writers per distinct connection factory (one per node) and
+    # returns one queue per table, so every table is owned by a single writer connected where it lives
+    groups = {}
+    for index, factory in enumerate(tablefactories):
+        groups.setdefault(factory, []).append(index)
+    tablequeues = [None] * len(tablefactories)
+    allqueues, allwriters, errors = [], [], []
+    for factory, indexes in groups.items():
+        n = max(1, min(numberofwriters, len(indexes)))
+        queues, writers, _ = _startwriters(factory, n, batchsize, 2, errors=errors)
+        for position, index in enumerate(indexes):
+            tablequeues[index] = queues[position % n]
+        allqueues += queues
+        allwriters += writers
+    return tablequeues, allqueues, allwriters, errors
+
+
+def _routerows(selectsql, openconnection, tablenames, route, connectionfactory=None,
+               numberofwriters=4, batchsize=BATCH_SIZE, tablefactories=None, maxbuffered=MAX_BUFFERED_ROWS):
+    # One streaming read of selectsql; route(row) picks the index into tablenames (or None to skip).
+    # Each table is owned by a single writer so its rows are flushed in bulk on one connection.
+    # tablefactories, parallel to tablenames, opens each table's writer on its own node.
+    # At most maxbuffered rows wait in the buffers, however many tables there are.
+    con = openconnection
+    connectionfactory = connectionfactory or _connectionfactory(con)
+    buffers = [[] for _ in tablenames]
+    counts = [0] * len(tablenames)
+    buffered = 0
+
+    tablequeues, queues, writers, errors = _tablewriters(tablefactories or [connectionfactory] * len(tablenames),
+                                                         numberofwriters, batchsize)
+    try:
+        cur = statementProfiler.cursor(con)
+        cur.execute(selectsql)
+        while not errors:
+            rows = cur.fetchmany(batchsize)
+            if not rows:
+                break
+            for row in rows:
+                index = route(row)
+                if index is None:
+                    continue
+                buffers[index].append(row)
+                counts[index] += 1
+                buffered += 1
+                if len(buffers[index]) < batchsize:
+                    if buffered < maxbuffered:
+                        continue
+                    index = max(range(len(buffers)), key=lambda i: len(buffers[i]))
+                tablequeues[index].put((tablenames[index], buffers[index]))
+                buffered -= len(buffers[index])
+                buffers[index] = []
+        if errors:
+            cur.fetchall()
+        cur.close()
+        for index, rows in enumerate(buffers):
+            if rows:
+                tablequeues[index].put((tablenames[index], rows))
+    finally:
+        _stopwriters(queues, writers, errors)
+    return counts
+
+
+def _rangebounds(numberofpartitions):
+    # Upper bounds of the equal-width intervals [0, b0], (b0, b1], ..., (bn-2, 5]
+    delta = 5.0 / numberofpartitions
+    return [i * delta + delta for i in range(numberofpartitions)]
+
+
+def _rangeindex(rating, bounds):
+    if rating < 0 or rating > bounds[-1]:
+        return None
+    return bisect.bisect_left(bounds, rating)
+
+
+def _loadinfile(openconnection, tablename, ratingsfilepath):
+    # One LOAD DATA straight from the userid::movieid::rating::timestamp file, no parsing in Python.
+    # It runs on a connection that may only read the file's own directory, unless the caller's
+    # settings (MYSQL_LOCAL_INFILE) already allow local files. The server needs local_infile=ON.
+    config = connectionPool.configof(openconnection)
+    ratingsfilepath = os.path.abspath(ratingsfilepath)
+    localinfile = (config.get('allow_local_infile') or config.get('allow_local_infile_in_path') or
+                   os.path.dirname(ratingsfilepath))
+    con = connectionPool.getpool(config['user'], config['password'], config['database'], config['host'],
+                                 config['port'], localinfile).getconnection()
+    try:
+        cur = statementProfiler.cursor(con)
+        cur.execute("LOAD DATA LOCAL INFILE %s INTO TABLE " + tablename +
+                    " FIELDS TERMINATED BY '::' LINES TERMINATED BY '\\n' (userid, movieid, rating, @timestamp)",
+                    (ratingsfilepath,))
+        rows = cur.rowcount
+        cur.close()
+        con.commit()
+    finally:
+        con.close()
+    return rows
+
+
+def _loadstats(rows, elapsed):
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed > 0 else float('inf')
+    }
+
+
+@statementProfiler.instrumented
+def loadratings(ratingstablename, ratingsfilepath, openconnection, mode='batch',
+                batchsize=BATCH_SIZE, commitinterval=COMMIT_INTERVAL, layout=None):
 
+    con = openconnection
+    cur = statementProfiler.cursor(con)
+    start = time.time()
+    rows = 0
+
+    cur.execute("DROP TABLE IF EXISTS " + ratingstablename)
+    _createratingstable(cur, ratingstablename, layout)
 
-def getopenconnection(user='root', password='123456', dbname='mysql'):
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='123456',
-        database=dbname
-    )
+    if mode == 'row':
+        with open(ratingsfilepath, 'r') as f:
+            for line in f:
+                userid, _, movieid, _, rating, _, _ = line.strip().split(':')
+                cur.execute("INSERT INTO " + ratingstablename +
+                           " (userid, movieid, rating) VALUES (%s, %s, %s)",
+                           (int(userid), int(movieid), float(rating)))
+                rows += 1
+    elif mode == 'infile':
+        con.commit()
+        rows = _loadinfile(con, ratingstablename, ratingsfilepath)
+    elif mode == 'batch':
+        pending = 0
+        for batch in _readbatches(ratingsfilepath, batchsize):
+            cur.executemany("INSERT INTO " + ratingstablename +
+                            " (userid, movieid, rating) VALUES (%s, %s, %s)", batch)
+            rows += len(batch)
+            pending += len(batch)
+            if pending >= commitinterval:
+                con.commit()
+                pending = 0
+    else:
+        raise ValueError("Unknown load mode: " + str(mode))
+
+    cur.close()
+    con.commit()
+    _buildindexes(con, [ratingstablename], layout)
+    return _loadstats(rows, time.time() - start)
 
 
-def loadratings(ratingstablename, ratingsfilepath, openconnection): 
+def _parsercontext():
+    # The writer threads and their open connections are already running when parsers start, and forking
+    # then would copy held locks and sockets into the children; forkserver and spawn start them clean
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+@statementProfiler.instrumented
+def parallelloadratings(ratingstablename, ratingsfilepath, openconnection, numberofwriters=4,
+                        numberofparsers=None, chunkbytes=CHUNK_BYTES, batchsize=BATCH_SIZE,
+                        maxpending=None, connectionfactory=None, layout=None):
 
     con = openconnection
-    cur = con.cursor()
-    
+    cur = statementProfiler.cursor(con)
+    start = time.time()
+    rows = 0
+
     cur.execute("DROP TABLE IF EXISTS " + ratingstablename)
-    cur.execute("CREATE TABLE " + ratingstablename + 
-               " (userid INTEGER, movieid INTEGER, rating FLOAT)")
-    
-    with open(ratingsfilepath, 'r') as f:
-        for line in f:
-            userid, _, movieid, _, rating, _, _ = line.strip().split(':')
-            cur.execute("INSERT INTO " + ratingstablename + 
-                       " (userid, movieid, rating) VALUES (%s, %s, %s)",
-                       (int(userid), int(movieid), float(rating)))
-    
+    _createratingstable(cur, ratingstablename, layout)
     cur.close()
     con.commit()
 
-def rangepartition(ratingstablename, numberofpartitions, openconnection):
+    connectionfactory = connectionfactory or _connectionfactory(con)
+    # Bounded queue and bounded in-flight parses give back-pressure when the server is slow
+    maxpending = maxpending or 2 * numberofwriters
+    queues, writers, errors = _startwriters(connectionfactory, numberofwriters, batchsize, maxpending,
+                                            shared=True)
+
+    try:
+        with ProcessPoolExecutor(max_workers=numberofparsers, mp_context=_parsercontext()) as parsers:
+            inflight = []
+            chunk = 0
+            for chunkstart, chunkend in _filechunks(ratingsfilepath, chunkbytes):
+                if errors:
+                    break
+                inflight.append(parsers.submit(_parsechunk, (ratingsfilepath, chunkstart, chunkend)))
+                if len(inflight) >= maxpending:
+                    parsed = inflight.pop(0).result()
+                    rows += len(parsed[0])
+                    queues[chunk % numberofwriters].put((ratingstablename, parsed))
+                    chunk += 1
+            for future in inflight:
+                parsed = future.result()
+                rows += len(parsed[0])
+                queues[chunk % numberofwriters].put((ratingstablename, parsed))
+                chunk += 1
+    finally:
+        _stopwriters(queues, writers, errors)
+
+    _buildindexes(con, [ratingstablename], layout)
+    return _loadstats(rows, time.time() - start)
+
+def _createcatalog(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS " + CATALOG_TABLE +
+                " (scheme VARCHAR(32) PRIMARY KEY, prefix VARCHAR(64), sourcetable VARCHAR(64),"
+                " numberofpartitions INTEGER, boundaries TEXT, nextslot BIGINT, partitionkey VARCHAR(64),"
+                " version BIGINT NOT NULL DEFAULT 0)")
+    # Catalogs saved before the version column existed get it on their next save or repartition
+    try:
+        cur.execute("SELECT version FROM " + CATALOG_TABLE + " LIMIT 0")
+        cur.fetchall()
+    except mysql.connector.Error as e:
+        if e.errno != errorcode.ER_BAD_FIELD_ERROR:
+            raise
+        cur.execute("ALTER TABLE " + CATALOG_TABLE + " ADD COLUMN version BIGINT NOT NULL DEFAULT 0")
+    # Advanced by reserveslots in its own short transaction, so the row lock never outlives one UPDATE
+    cur.execute("CREATE TABLE IF NOT EXISTS " + SEQUENCE_TABLE +
+                " (name VARCHAR(32) PRIMARY KEY, nextslot BIGINT NOT NULL) ENGINE=InnoDB")
+
+
+def savecatalog(scheme, prefix, sourcetable, numberofpartitions, openconnection, boundaries=None, nextslot=0,
+                partitionkey=None):
 
     con = openconnection
-    cur = con.cursor()
-    delta = 5.0 / numberofpartitions
+    cur = statementProfiler.cursor(con)
+    _createcatalog(cur)
+    # A new version tells other processes that their cached entry for the scheme is stale
+    version = _catalogversion(cur, scheme) or 0
+    cur.execute("REPLACE INTO " + CATALOG_TABLE +
+                " (scheme, prefix, sourcetable, numberofpartitions, boundaries, nextslot, partitionkey, version)"
+                " VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                (scheme, prefix, sourcetable, numberofpartitions,
+                 ','.join(repr(b) for b in boundaries) if boundaries else None, nextslot, partitionkey, version + 1))
+    cur.execute("REPLACE INTO " + SEQUENCE_TABLE + " (name, nextslot) VALUES (%s, %s)", (scheme, nextslot))
+    cur.close()
+    con.commit()
+    invalidatecatalog(scheme)
+
+
+def _catalogversion(cur, scheme, lock=False):
+    # None when the scheme has no entry, 0 when the catalog predates the version column.
+    # lock keeps a shared lock on the row until the transaction ends, so a repartition cannot
+    # swap partitions under rows routed with that version.
+    try:
+        cur.execute("SELECT version FROM " + CATALOG_TABLE + " WHERE scheme = %s" +
+                    (" LOCK IN SHARE MODE" if lock else ""), (scheme,))
+        row = cur.fetchone()
+    except mysql.connector.Error as e:
+        if e.errno != errorcode.ER_BAD_FIELD_ERROR:
+            raise
+        return 0
+    return row[0] if row is not None else None
+
+
+def _catalogcurrent(cur, scheme, openconnection):
+    # Called inside the insert transaction before its rows are written. Another process may have
+    # repartitioned since this one cached the catalog; if so the cached entry is dropped and the
+    # caller routes again.
+    catalog = getcatalog(scheme, openconnection)
+    if catalog is None or _catalogversion(cur, scheme, lock=True) in (None, catalog['version']):
+        return True
+    _catalogcache.pop(_catalogkey(openconnection, scheme), None)
+    return False
+
+
+def _catalogkey(openconnection, scheme):
+    config = connectionPool.configof(openconnection)
+    return config['host'], config['port'], config['database'], scheme
+
+
+def getcatalog(scheme, openconnection):
+    # The static part of an entry (prefix, count, boundaries) is cached per server and database, and
+    # inserts check its version against the catalog row (see _catalogcurrent) so a repartition by
+    # another process is noticed; nextslot is the slot count saved with the partitioning, the live
+    # counter is in SEQUENCE_TABLE
+    key = _catalogkey(openconnection, scheme)
+    entry = _catalogcache.get(key)
+    if entry is not None:
+        return entry
+
+    cur = statementProfiler.cursor(openconnection)
+    try:
+        cur.execute("SELECT prefix, sourcetable, numberofpartitions, boundaries, nextslot, partitionkey FROM " +
+                    CATALOG_TABLE + " WHERE scheme = %s", (scheme,))
+        row = cur.fetchone()
+        version = _catalogversion(cur, scheme) if row is not None else None
+    except mysql.connector.Error:
+        row = None
+    finally:
+        cur.close()
+    if row is None:
+        return None
+
+    prefix, sourcetable, numberofpartitions, boundaries, nextslot, partitionkey = row
+    entry = {
+        'scheme': scheme,
+        'prefix': prefix,
+        'sourcetable': sourcetable,
+        'numberofpartitions': numberofpartitions,
+        'boundaries': [float(b) for b in boundaries.split(',')] if boundaries else None,
+        'nextslot': nextslot,
+        'partitionkey': partitionkey,
+        'version': version
+    }
+    _catalogcache[key] = entry
+    return entry
+
+
+def invalidatecatalog(scheme=None):
+    for key in list(_catalogcache):
+        if scheme is None or key[-1] == scheme:
+            del _catalogcache[key]
+
+
+def ratinghistogram(ratingstablename, openconnection):
+
+    cur = statementProfiler.cursor(openconnection)
+    cur.execute("SELECT rating, COUNT(*) FROM " + ratingstablename + " GROUP BY rating ORDER BY rating")
+    histogram = [(float(rating), int(count)) for rating, count in cur.fetchall()]
+    cur.close()
+    return histogram
+
+
+def _equidepthbounds(histogram, numberofpartitions):
+    # Each cut is placed where the running count comes closest to an even share of the rows not yet
+    # assigned, so one overshoot is not carried into every later partition. Every cut takes at least one
+    # rating value and leaves one for each later partition; only with fewer distinct values than
+    # partitions do bounds repeat, and (b, b] holds nothing. An empty table gets equal-width bounds.
+    if not histogram:
+        return _rangebounds(numberofpartitions)
+    bounds = []
+    remaining = sum(count for _, count in histogram)
+    position = 0
+    for i in range(numberofpartitions - 1):
+        if position >= len(histogram):
+            bounds.append(bounds[-1])
+            continue
+        left = numberofpartitions - i
+        target = remaining / float(left)
+        limit = max(position + 1, len(histogram) - (left - 1))
+        rating, seen = histogram[position]
+        position += 1
+        while position < limit and abs(seen + histogram[position][1] - target) < abs(seen - target):
+            rating = histogram[position][0]
+            seen += histogram[position][1]
+            position += 1
+        bounds.append(rating)
+        remaining -= seen
+    bounds.append(max([5.0] + bounds))
+    return bounds
+
+
+def _histogramcounts(histogram, bounds):
+    counts = [0] * len(bounds)
+    for rating, count in histogram:
+        index = _rangeindex(rating, bounds)
+        if index is not None:
+            counts[index] += count
+    return counts
+
+
+def _skew(counts):
+    # Largest partition relative to a perfectly even split; 1.0 means balanced
+    mean = sum(counts) / float(len(counts))
+    return max(counts) / mean if mean else 1.0
+
+
+@statementProfiler.instrumented
+def rangepartition(ratingstablename, numberofpartitions, openconnection, mode='stream',
+                   numberofwriters=4, connectionfactory=None, balanced=False, layout=None):
+
+    con = openconnection
+    cur = statementProfiler.cursor(con)
     RANGE_TABLE_PREFIX = 'range_part'
-    
-    for i in range(numberofpartitions):
-        cur.execute("DROP TABLE IF EXISTS " + RANGE_TABLE_PREFIX + str(i))
-    
+    tablenames = [RANGE_TABLE_PREFIX + str(i) for i in range(numberofpartitions)]
+    if mode not in ('stream', 'scan'):
+        raise ValueError("Unknown partition mode: " + str(mode))
+
+    for table_name in tablenames:
+        cur.execute("DROP TABLE IF EXISTS " + table_name)
+        _createratingstable(cur, table_name, layout)
+    con.commit()
+
+    bounds = _rangebounds(numberofpartitions)
+    report = None
+    if balanced:
+        histogram = ratinghistogram(ratingstablename, con)
+        before = _histogramcounts(histogram, bounds)
+        bounds = _equidepthbounds(histogram, numberofpartitions)
+        after = _histogramcounts(histogram, bounds)
+        report = {
+            'boundaries': bounds,
+            'before': before,
+            'after': after,
+            'skew_before': _skew(before),
+            'skew_after': _skew(after)
+        }
+    savecatalog('range', RANGE_TABLE_PREFIX, ratingstablename, numberofpartitions, con, boundaries=bounds)
+
+    if mode == 'stream':
+        cur.close()
+        _routerows("SELECT userid, movieid, rating FROM " + ratingstablename, con, tablenames,
+                   lambda row: _rangeindex(row[2], bounds), connectionfactory, numberofwriters)
+        _buildindexes(con, tablenames, layout)
+        return report
+
     for i in range(numberofpartitions):
-        minRange = i * delta
-        maxRange = minRange + delta
-        table_name = RANGE_TABLE_PREFIX + str(i)
-        
-        cur.execute("CREATE TABLE " + table_name + 
-                   " (userid INTEGER, movieid INTEGER, rating FLOAT)")
-        
+        maxRange = bounds[i]
+        table_name = tablenames[i]
+
         if i == 0:
-            cur.execute("INSERT INTO " + table_name + 
-                       " SELECT userid, movieid, rating FROM " + ratingstablename + 
-                       " WHERE rating >= %s AND rating <= %s", (minRange, maxRange))
+            cur.execute("INSERT INTO " + table_name +
+                       " SELECT userid, movieid, rating FROM " + ratingstablename +
+                       " WHERE rating >= %s AND rating <= %s", (0, maxRange))
         else:
-            cur.execute("INSERT INTO " + table_name + 
-                       " SELECT userid, movieid, rating FROM " + ratingstablename + 
-                       " WHERE rating > %s AND rating <= %s", (minRange, maxRange))
-    
+            cur.execute("INSERT INTO " + table_name +
+                       " SELECT userid, movieid, rating FROM " + ratingstablename +
+                       " WHERE rating > %s AND rating <= %s", (bounds[i - 1], maxRange))
+
     cur.close()
     con.commit()
+    _buildindexes(con, tablenames, layout)
+    return report
 
-def roundrobinpartition(ratingstablename, numberofpartitions, openconnection):
+def _roundrobinroute(numberofpartitions):
+    # Row k (0-based, in read order) goes to partition k mod n, like ROW_NUMBER() - 1
+    position = [0]
+
+    def route(row):
+        index = position[0] % numberofpartitions
+        position[0] += 1
+        return index
+    return route
+
+
+@statementProfiler.instrumented
+def roundrobinpartition(ratingstablename, numberofpartitions, openconnection, mode='stream',
+                        numberofwriters=4, connectionfactory=None, layout=None):
 
     con = openconnection
-    cur = con.cursor()
+    cur = statementProfiler.cursor(con)
     RROBIN_TABLE_PREFIX = 'rrobin_part'
+    tablenames = [RROBIN_TABLE_PREFIX + str(i) for i in range(numberofpartitions)]
+
+    if mode == 'stream':
+        for table_name in tablenames:
+            cur.execute("DROP TABLE IF EXISTS " + table_name)
+            _createratingstable(cur, table_name, layout)
+        con.commit()
+        cur.close()
+        # One sort of the master table numbers every row; all partitions are filled from that pass
+        counts = _routerows("SELECT userid, movieid, rating FROM " + ratingstablename + " ORDER BY userid ASC",
+                            con, tablenames, _roundrobinroute(numberofpartitions), connectionfactory,
+                            numberofwriters)
+        _buildindexes(con, tablenames, layout)
+        savecatalog('roundrobin', RROBIN_TABLE_PREFIX, ratingstablename, numberofpartitions, con,
+                    nextslot=sum(counts))
+        return
+    if mode != 'window':
+        raise ValueError("Unknown partition mode: " + str(mode))
 
     for i in range(numberofpartitions):
-        table_name = RROBIN_TABLE_PREFIX + str(i)
+        table_name = tablenames[i]
         cur.execute("DROP TABLE IF EXISTS " + table_name)
-        cur.execute("CREATE TABLE " + table_name + " (userid INTEGER, movieid INTEGER, rating FLOAT)")
+        _createratingstable(cur, table_name, layout)
         sql_insert = (
             "INSERT INTO `" + table_name + "` (userid, movieid, rating) "
             "SELECT userid, movieid, rating "
@@ -88,69 +641,342 @@ def roundrobinpartition(ratingstablename, numberofpartitions, openconnection):
         )
         cur.execute(sql_insert)
 
+    cur.execute("SELECT COUNT(*) FROM " + ratingstablename)
+    total_rows = cur.fetchone()[0]
     con.commit()
     cur.close()
+    _buildindexes(con, tablenames, layout)
+    savecatalog('roundrobin', RROBIN_TABLE_PREFIX, ratingstablename, numberofpartitions, con,
+                nextslot=total_rows)
 
-def roundrobininsert(ratingstablename, userid, itemid, rating, openconnection):
+@statementProfiler.instrumented
+def loadandpartition(ratingstablename, ratingsfilepath, openconnection, rangepartitions=None,
+                     roundrobinpartitions=None, loadmaster=True, numberofwriters=4, batchsize=BATCH_SIZE,
+                     connectionfactory=None, layout=None):
 
+    # One read of the file routes every row straight into its range and/or round robin partition.
+    # Round robin follows file order, which is ORDER BY userid for the (userid-sorted) MovieLens dumps.
     con = openconnection
-    cur = con.cursor()
+    RANGE_TABLE_PREFIX = 'range_part'
+    RROBIN_TABLE_PREFIX = 'rrobin_part'
+    start = time.time()
+    rangetables = [RANGE_TABLE_PREFIX + str(i) for i in range(rangepartitions or 0)]
+    rrobintables = [RROBIN_TABLE_PREFIX + str(i) for i in range(roundrobinpartitions or 0)]
+    tablenames = ([ratingstablename] if loadmaster else []) + rangetables + rrobintables
+    if not tablenames:
+        raise ValueError("Nothing to load: no master table and no partitions requested")
+
+    cur = statementProfiler.cursor(con)
+    for table_name in tablenames:
+        cur.execute("DROP TABLE IF EXISTS " + table_name)
+        _createratingstable(cur, table_name, layout)
+    cur.close()
+    con.commit()
+
+    connectionfactory = connectionfactory or _connectionfactory(con)
+    numberofwriters = max(1, min(numberofwriters, len(tablenames)))
+    bounds = _rangebounds(rangepartitions) if rangepartitions else None
+    buffers = dict((table_name, []) for table_name in tablenames)
+    owners = dict((table_name, i) for i, table_name in enumerate(rangetables + rrobintables))
+    buffered = [0]
+    rows = 0
+
+    def add(table_name, row):
+        buffers[table_name].append(row)
+        buffered[0] += 1
+        if len(buffers[table_name]) < batchsize:
+            if buffered[0] < MAX_BUFFERED_ROWS:
+                return
+            table_name = max(owners, key=lambda name: len(buffers[name]))
+        queues[owners[table_name] % numberofwriters].put((table_name, buffers[table_name]))
+        buffered[0] -= len(buffers[table_name])
+        buffers[table_name] = []
+
+    queues, writers, errors = _startwriters(connectionfactory, numberofwriters, batchsize, 2)
+    try:
+        for columns in ratingsParser.parsechunks(ratingsfilepath):
+            # Work batch by batch so only batchsize rows of the chunk exist as tuples at once
+            for part in ratingsParser.slices(columns, batchsize):
+                if errors:
+                    break
+                if loadmaster:
+                    # Master rows have no natural owner, so spread the batches over the writers
+                    queues[(rows // batchsize) % numberofwriters].put((ratingstablename, part))
+                if not bounds and not rrobintables:
+                    rows += len(part[0])
+                    continue
+                partrows = ratingsParser.rows(part)
+                if bounds:
+                    for row, index in zip(partrows, ratingsParser.rangeindexes(part[2], bounds).tolist()):
+                        if index >= 0:
+                            add(rangetables[index], row)
+                if rrobintables:
+                    for position, row in enumerate(partrows, rows):
+                        index = position % roundrobinpartitions
+                        add(rrobintables[index], row)
+                rows += len(partrows)
+        for i, table_name in enumerate(rangetables + rrobintables):
+            if buffers[table_name]:
+                queues[i % numberofwriters].put((table_name, buffers[table_name]))
+    finally:
+        _stopwriters(queues, writers, errors)
+
+    _buildindexes(con, tablenames, layout)
+    if rangepartitions:
+        savecatalog('range', RANGE_TABLE_PREFIX, ratingstablename, rangepartitions, con, boundaries=bounds)
+    if roundrobinpartitions:
+        savecatalog('roundrobin', RROBIN_TABLE_PREFIX, ratingstablename, roundrobinpartitions, con, nextslot=rows)
+    return _loadstats(rows, time.time() - start)
+
+@statementProfiler.instrumented
+def reserveslots(count, openconnection, scheme='roundrobin'):
+    """
+    Atomically claims count consecutive slots of a scheme's sequence in one UPDATE.
+    LAST_INSERT_ID(expr) hands the new value back on this connection only, so concurrent writers
+    never see each other's reservation. The UPDATE is committed at once: on openconnection when it has
+    no transaction open, otherwise on a connection kept for slot claims outside every pool, so the
+    caller's transaction never holds the lock and never waits for its own pool to free a connection.
+    :return: First claimed slot
+    """
+    if not openconnection.in_transaction:
+        return _claimslots(openconnection, count, scheme)
+    entry = _sequenceconnection(openconnection)
+    with entry['lock']:
+        if entry['connection'] is None:
+            entry['connection'] = mysql.connector.connect(**entry['config'])
+        try:
+            return _claimslots(entry['connection'], count, scheme)
+        except (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError):
+            # Dropped by the server while idle; a claim lost with it only leaves a gap in the slots
+            entry['connection'] = mysql.connector.connect(**entry['config'])
+            return _claimslots(entry['connection'], count, scheme)
+
+
+def _sequenceconnection(openconnection):
+    # One per server and database, shared under a lock; a claim is a single short UPDATE
+    config = connectionPool.configof(openconnection)
+    key = tuple(sorted(config.items()))
+    with _sequencelock:
+        entry = _sequenceconnections.get(key)
+        if entry is None:
+            entry = _sequenceconnections[key] = {'lock': threading.Lock(), 'config': dict(config),
+                                                 'connection': None}
+    return entry
+
+
+def _claimslots(con, count, scheme):
+    try:
+        cur = statementProfiler.cursor(con)
+        try:
+            cur.execute("UPDATE " + SEQUENCE_TABLE + " SET nextslot = LAST_INSERT_ID(nextslot + %s) WHERE name = %s",
+                        (count, scheme))
+            if cur.rowcount == 0:
+                raise ValueError("No slot sequence for " + scheme + "; partition the table again to create it")
+            slot = cur.lastrowid - count
+        finally:
+            cur.close()
+        con.commit()
+        return slot
+    except Exception:
+        con.rollback()
+        raise
+
+
+def _reserveslots(count, openconnection):
+    # (first slot, partitions, prefix) from the catalog's sequence; None for partitions without a catalog entry
+    catalog = getcatalog('roundrobin', openconnection)
+    if catalog is None:
+        return None
+    return reserveslots(count, openconnection), catalog['numberofpartitions'], catalog['prefix']
+
+
+def _countslots(cur, ratingstablename, count, openconnection):
+    # Partitions created without a catalog entry: the slot follows from the row count, which must
+    # already include the rows being inserted
     RROBIN_TABLE_PREFIX = 'rrobin_part'
-    
-    cur.execute("INSERT INTO " + ratingstablename + 
-               " (userid, movieid, rating) VALUES (%s, %s, %s)",
-               (userid, itemid, rating))
-    
     cur.execute("SELECT COUNT(*) FROM " + ratingstablename)
     total_rows = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name LIKE %s",
-                (RROBIN_TABLE_PREFIX + '%',))
-    numberofpartitions = cur.fetchone()[0]
-    
-    index = (total_rows - 1) % numberofpartitions
-    table_name = RROBIN_TABLE_PREFIX + str(index)
-    
-    cur.execute("INSERT INTO " + table_name + 
-               " (userid, movieid, rating) VALUES (%s, %s, %s)",
-               (userid, itemid, rating))
-    
-    cur.close()
+    return total_rows - count, count_partitions(RROBIN_TABLE_PREFIX, openconnection), RROBIN_TABLE_PREFIX
+
+
+def _rangetarget(openconnection):
+    RANGE_TABLE_PREFIX = 'range_part'
+    catalog = getcatalog('range', openconnection)
+    if catalog is not None:
+        return catalog['boundaries'], catalog['prefix']
+    # Partitions created without a catalog entry: fall back to counting tables
+    return _rangebounds(count_partitions(RANGE_TABLE_PREFIX, openconnection)), RANGE_TABLE_PREFIX
+
+
+def _begin(con):
+    # Opens an explicit transaction so the inserts stay atomic even on an autocommit connection
+    if not con.in_transaction:
+        con.start_transaction()
+
+
+def _insertgroups(cur, groups):
+    for table_name, tablerows in groups.items():
+        cur.executemany("INSERT INTO " + table_name +
+                        " (userid, movieid, rating) VALUES (%s, %s, %s)", tablerows)
+
+
+@statementProfiler.instrumented
+def roundrobininsert(ratingstablename, userid, itemid, rating, openconnection):
+
+    roundrobininsert_many(ratingstablename, [(userid, itemid, rating)], openconnection)
+
+@statementProfiler.instrumented
+def roundrobininsert_many(ratingstablename, rows, openconnection):
+
+    con = openconnection
+    rows = [(userid, itemid, rating) for userid, itemid, rating in rows]
+    if not rows:
+        return
+    # Slots are claimed before the transaction starts, so concurrent writers never wait on each other
+    target = _reserveslots(len(rows), con)
+    _begin(con)
+    cur = statementProfiler.cursor(con)
+    try:
+        cur.executemany("INSERT INTO " + ratingstablename +
+                        " (userid, movieid, rating) VALUES (%s, %s, %s)", rows)
+        slot, numberofpartitions, prefix = target or _countslots(cur, ratingstablename, len(rows), con)
+        groups = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(prefix + str((slot + i) % numberofpartitions), []).append(row)
+        _insertgroups(cur, groups)
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
     con.commit()
 
+@statementProfiler.instrumented
 def rangeinsert(ratingstablename, userid, itemid, rating, openconnection):
 
+    rangeinsert_many(ratingstablename, [(userid, itemid, rating)], openconnection)
+
+
+def _rangegroups(rows, openconnection):
+    bounds, prefix = _rangetarget(openconnection)
+    groups = {}
+    for row in rows:
+        index = _rangeindex(row[2], bounds)
+        if index is None:
+            raise ValueError("Rating " + str(row[2]) + " is outside every range partition")
+        groups.setdefault(prefix + str(index), []).append(row)
+    return groups
+
+
+@statementProfiler.instrumented
+def rangeinsert_many(ratingstablename, rows, openconnection):
+
     con = openconnection
-    cur = con.cursor()
-    RANGE_TABLE_PREFIX = 'range_part'
-    
+    rows = [(userid, itemid, rating) for userid, itemid, rating in rows]
+    if not rows:
+        return
+    groups = _rangegroups(rows, con)
 
-    cur.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name LIKE %s",
-                (RANGE_TABLE_PREFIX + '%',))
-    numberofpartitions = cur.fetchone()[0]
-    
+    _begin(con)
+    cur = statementProfiler.cursor(con)
+    try:
+        if not _catalogcurrent(cur, 'range', con):
+            groups = _rangegroups(rows, con)
+        cur.executemany("INSERT INTO " + ratingstablename +
+                        " (userid, movieid, rating) VALUES (%s, %s, %s)", rows)
+        _insertgroups(cur, groups)
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+    con.commit()
 
-    delta = 5.0 / numberofpartitions
-    index = int(rating / delta)
-    if rating % delta == 0 and index != 0:
-        index = index - 1
-    
-
-    table_name = RANGE_TABLE_PREFIX + str(index)
-    cur.execute("INSERT INTO " + ratingstablename + 
-               " (userid, movieid, rating) VALUES (%s, %s, %s)",
-               (userid, itemid, rating))
-    cur.execute("INSERT INTO " + table_name + 
-               " (userid, movieid, rating) VALUES (%s, %s, %s)",
-               (userid, itemid, rating))
-    
+def _hashindex(key, numberofpartitions):
+    # Jump consistent hash: growing n to n + k only moves keys into the k new partitions
+    key = int(key) & 0xFFFFFFFFFFFFFFFF
+    bucket, j = -1, 0
+    while j < numberofpartitions:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+@statementProfiler.instrumented
+def hashpartition(ratingstablename, column, numberofpartitions, openconnection, numberofwriters=4,
+                  connectionfactory=None, layout=None):
+
+    con = openconnection
+    HASH_TABLE_PREFIX = 'hash_part'
+    if column not in HASH_COLUMNS:
+        raise ValueError("Hash partitioning needs one of " + ', '.join(HASH_COLUMNS) + ", got " + str(column))
+    if not isinstance(numberofpartitions, int) or numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be a positive integer")
+    tablenames = [HASH_TABLE_PREFIX + str(i) for i in range(numberofpartitions)]
+    position = HASH_COLUMNS.index(column)
+
+    cur = statementProfiler.cursor(con)
+    for table_name in tablenames:
+        cur.execute("DROP TABLE IF EXISTS " + table_name)
+        _createratingstable(cur, table_name, layout)
+    con.commit()
     cur.close()
+
+    savecatalog('hash', HASH_TABLE_PREFIX, ratingstablename, numberofpartitions, con, partitionkey=column)
+    _routerows("SELECT userid, movieid, rating FROM " + ratingstablename, con, tablenames,
+               lambda row: _hashindex(row[position], numberofpartitions), connectionfactory, numberofwriters)
+    _buildindexes(con, tablenames, layout)
+
+def _hashtarget(openconnection):
+    catalog = getcatalog('hash', openconnection)
+    if catalog is None:
+        raise ValueError("No hash partitioning found; run hashpartition first")
+    return catalog['prefix'], catalog['numberofpartitions'], HASH_COLUMNS.index(catalog['partitionkey'])
+
+
+@statementProfiler.instrumented
+def hashinsert(ratingstablename, userid, itemid, rating, openconnection):
+
+    hashinsert_many(ratingstablename, [(userid, itemid, rating)], openconnection)
+
+
+def _hashgroups(rows, openconnection):
+    prefix, numberofpartitions, position = _hashtarget(openconnection)
+    groups = {}
+    for row in rows:
+        groups.setdefault(prefix + str(_hashindex(row[position], numberofpartitions)), []).append(row)
+    return groups
+
+
+@statementProfiler.instrumented
+def hashinsert_many(ratingstablename, rows, openconnection):
+
+    con = openconnection
+    rows = [(userid, itemid, rating) for userid, itemid, rating in rows]
+    if not rows:
+        return
+    groups = _hashgroups(rows, con)
+
+    _begin(con)
+    cur = statementProfiler.cursor(con)
+    try:
+        if not _catalogcurrent(cur, 'hash', con):
+            groups = _hashgroups(rows, con)
+        cur.executemany("INSERT INTO " + ratingstablename +
+                        " (userid, movieid, rating) VALUES (%s, %s, %s)", rows)
+        _insertgroups(cur, groups)
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
     con.commit()
 
 def count_partitions(prefix, openconnection):
 
     con = openconnection
-    cur = con.cursor()
+    cur = statementProfiler.cursor(con)
     cur.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name LIKE %s",
                 (prefix + '%',))
     count = cur.fetchone()[0]
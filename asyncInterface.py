@@ -0,0 +1,190 @@
+#
+# asyncio versions of the Interface functions, running the blocking driver on a managed executor
+#
+import asyncio
+import contextlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import connectionPool
+import Interface
+import ratingsParser
+
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+
+
+class AsyncConnectionPool(object):
+    """
+    Pool for coroutines: at most size connections are borrowed at once, and every driver call runs on a
+    private thread pool of the same size, so waiting coroutines never block the event loop or each other.
+    :param size: Maximum number of connections and executor threads; partitioning holds one for reading,
+                 so at least 2
+    :param config: Connection settings, see connectionPool.dbconfig
+    """
+
+    def __init__(self, size=connectionPool.POOL_SIZE, user=None, password=None, dbname=None, host=None,
+                 port=None):
+        if size < 2:
+            raise ValueError("An async pool needs at least 2 connections")
+        self.pool = connectionPool.ConnectionPool(size=size, **connectionPool.dbconfig(user, password, dbname,
+                                                                                       host, port))
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        self._slots = asyncio.Semaphore(size)
+
+    async def run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def acquire(self):
+        await self._slots.acquire()
+        try:
+            return await self.run(self.pool.getconnection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, connection):
+        try:
+            await self.run(connection.close)
+        finally:
+            self._slots.release()
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        connection = await self.acquire()
+        try:
+            yield connection
+        finally:
+            await self.release(connection)
+
+    def stats(self):
+        return self.pool.stats()
+
+    async def close(self):
+        await self.run(self.pool.closeall)
+        self.executor.shutdown(wait=True)
+
+
+async def _call(pool, function, *args, **kwargs):
+    # Runs an Interface function with a borrowed connection as its openconnection argument
+    async with pool.connection() as con:
+        return await pool.run(function, *(args + (con,)), **kwargs)
+
+
+def _insertrows(tablename, rows, openconnection):
+    cur = openconnection.cursor()
+    cur.executemany("INSERT INTO " + tablename + " (userid, movieid, rating) VALUES (%s, %s, %s)", rows)
+    cur.close()
+    openconnection.commit()
+
+
+def _createtables(tablenames, layout, openconnection):
+    cur = openconnection.cursor()
+    for tablename in tablenames:
+        cur.execute("DROP TABLE IF EXISTS " + tablename)
+        Interface._createratingstable(cur, tablename, layout)
+    cur.close()
+    openconnection.commit()
+
+
+def _buildindexes(tablenames, layout, openconnection):
+    Interface._buildindexes(openconnection, tablenames, layout)
+
+
+async def _flush(pool, buffers):
+    # One insert per full buffer, all partitions at the same time
+    await asyncio.gather(*[_call(pool, _insertrows, tablename, rows) for tablename, rows in buffers])
+
+
+async def _routerows(pool, selectsql, tablenames, route, batchsize, maxbuffered=Interface.MAX_BUFFERED_ROWS):
+    buffers = [[] for _ in tablenames]
+    counts = [0] * len(tablenames)
+    buffered = 0
+    async with pool.connection() as con:
+        cur = await pool.run(con.cursor)
+        await pool.run(cur.execute, selectsql)
+        while True:
+            rows = await pool.run(cur.fetchmany, batchsize)
+            if not rows:
+                break
+            full = []
+            for row in rows:
+                index = route(row)
+                if index is None:
+                    continue
+                buffers[index].append(row)
+                counts[index] += 1
+                buffered += 1
+                if len(buffers[index]) < batchsize:
+                    if buffered < maxbuffered:
+                        continue
+                    # Too many rows spread over the buffers, ship the largest one early
+                    index = max(range(len(buffers)), key=lambda i: len(buffers[i]))
+                full.append((tablenames[index], buffers[index]))
+                buffered -= len(buffers[index])
+                buffers[index] = []
+            await _flush(pool, full)
+        await pool.run(cur.close)
+    await _flush(pool, [(tablenames[i], rows) for i, rows in enumerate(buffers) if rows])
+    return counts
+
+
+async def loadratings(ratingstablename, ratingsfilepath, pool, batchsize=Interface.BATCH_SIZE, layout=None):
+    await _call(pool, _createtables, [ratingstablename], layout)
+    chunks = ratingsParser.parsechunks(ratingsfilepath)
+    loaded = 0
+    while True:
+        columns = await pool.run(next, chunks, None)
+        if columns is None:
+            break
+        # One round of concurrent inserts per pool's worth of batches, so only those exist as tuples
+        parts = list(ratingsParser.slices(columns, batchsize))
+        for i in range(0, len(parts), pool.size):
+            await _flush(pool, [(ratingstablename, ratingsParser.rows(part)) for part in parts[i:i + pool.size]])
+        loaded += len(columns[0])
+    await _call(pool, _buildindexes, [ratingstablename], layout)
+    return loaded
+
+
+async def rangepartition(ratingstablename, numberofpartitions, pool, batchsize=Interface.BATCH_SIZE, layout=None):
+    tablenames = [RANGE_TABLE_PREFIX + str(i) for i in range(numberofpartitions)]
+    bounds = Interface._rangebounds(numberofpartitions)
+    await _call(pool, _createtables, tablenames, layout)
+    await _call(pool, Interface.savecatalog, 'range', RANGE_TABLE_PREFIX, ratingstablename, numberofpartitions,
+                boundaries=bounds)
+    await _routerows(pool, "SELECT userid, movieid, rating FROM " + ratingstablename, tablenames,
+                     lambda row: Interface._rangeindex(row[2], bounds), batchsize)
+    await _call(pool, _buildindexes, tablenames, layout)
+
+
+async def roundrobinpartition(ratingstablename, numberofpartitions, pool, batchsize=Interface.BATCH_SIZE,
+                              layout=None):
+    tablenames = [RROBIN_TABLE_PREFIX + str(i) for i in range(numberofpartitions)]
+    await _call(pool, _createtables, tablenames, layout)
+    counts = await _routerows(pool, "SELECT userid, movieid, rating FROM " + ratingstablename + " ORDER BY userid ASC",
+                              tablenames, Interface._roundrobinroute(numberofpartitions), batchsize)
+    await _call(pool, _buildindexes, tablenames, layout)
+    await _call(pool, Interface.savecatalog, 'roundrobin', RROBIN_TABLE_PREFIX, ratingstablename,
+                numberofpartitions, nextslot=sum(counts))
+
+
+async def rangeinsert(ratingstablename, userid, itemid, rating, pool):
+    await _call(pool, Interface.rangeinsert, ratingstablename, userid, itemid, rating)
+
+
+async def roundrobininsert(ratingstablename, userid, itemid, rating, pool):
+    await _call(pool, Interface.roundrobininsert, ratingstablename, userid, itemid, rating)
+
+
+async def hashinsert(ratingstablename, userid, itemid, rating, pool):
+    await _call(pool, Interface.hashinsert, ratingstablename, userid, itemid, rating)
+
+
+async def rangeinsert_many(ratingstablename, rows, pool):
+    await _call(pool, Interface.rangeinsert_many, ratingstablename, list(rows))
+
+
+async def roundrobininsert_many(ratingstablename, rows, pool):
+    await _call(pool, Interface.roundrobininsert_many, ratingstablename, list(rows))
@@ -0,0 +1,236 @@
+#
+# Benchmarks for loading, partitioning, inserting and querying, with a synthetic MovieLens-style data generator
+#
+DATABASE_NAME = 'dds_assgn1'
+RATINGS_TABLE = 'ratings'
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+INPUT_FILE_PATH = 'test_data.dat'
+RATING_VALUES = [i * 0.5 for i in range(1, 11)]
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import tempfile
+import time
+
+import bufferedWriter
+import testHelper
+import Interface as MyAssignment
+import partitionQuery
+
+
+def generateratings(ratingsfilepath, rows, users=None, movies=None, skew=1.0, seed=0):
+    """
+    Writes a userid::movieid::rating::timestamp file sorted by userid, like the MovieLens dumps
+    :param rows: Number of lines to write
+    :param users: Number of distinct users, defaults to rows / 100
+    :param movies: Number of distinct movies, defaults to rows / 10
+    :param skew: 0 gives uniform ratings and movies; larger values bunch ratings around 3.5-4
+                 and make popular movies more popular (Zipf-like)
+    :param seed: Random seed, so the same arguments always give the same file
+    """
+    rng = random.Random(seed)
+    users = users or max(1, rows // 100)
+    movies = movies or max(1, rows // 10)
+    weights = [math.exp(-skew * (rating - 3.75) ** 2) for rating in RATING_VALUES]
+    timestamp = 838985046
+    lines = []
+    with open(ratingsfilepath, 'w') as f:
+        for i in range(rows):
+            userid = 1 + i * users // rows
+            if skew > 0:
+                movieid = 1 + int(rng.paretovariate(skew) - 1) % movies
+            else:
+                movieid = rng.randint(1, movies)
+            rating = rng.choices(RATING_VALUES, weights)[0]
+            lines.append('{0}::{1}::{2:g}::{3}\n'.format(userid, movieid, rating, timestamp + i))
+            if len(lines) >= 100000:
+                f.writelines(lines)
+                lines = []
+        f.writelines(lines)
+
+
+def droppartitions(prefix, openconnection):
+    cur = openconnection.cursor()
+    cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name LIKE %s",
+                (prefix + '%',))
+    tablenames = [row[0] for row in cur.fetchall()]
+    for tablename in tablenames:
+        cur.execute("DROP TABLE IF EXISTS " + tablename)
+    cur.close()
+    openconnection.commit()
+
+
+def timecall(function, *args, **kwargs):
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def benchmarkrangepartition(ratingstablename, partitioncounts, openconnection):
+    """
+    Times the per-partition scan and the single-pass stream range partitioners
+    :param partitioncounts: Numbers of partitions to try
+    :return: One result dict per (mode, partition count)
+    """
+    results = []
+    for n in partitioncounts:
+        for mode in ('scan', 'stream'):
+            droppartitions(RANGE_TABLE_PREFIX, openconnection)
+            seconds = timecall(MyAssignment.rangepartition, ratingstablename, n, openconnection, mode=mode)
+            results.append({'function': 'rangepartition', 'mode': mode, 'partitions': n, 'seconds': seconds})
+    droppartitions(RANGE_TABLE_PREFIX, openconnection)
+    return results
+
+
+def benchmarkroundrobinpartition(ratingstablename, partitioncounts, openconnection):
+    """
+    Times the ROW_NUMBER() per-partition and the single-pass stream round robin partitioners
+    :param partitioncounts: Numbers of partitions to try
+    :return: One result dict per (mode, partition count)
+    """
+    results = []
+    for n in partitioncounts:
+        for mode in ('window', 'stream'):
+            droppartitions(RROBIN_TABLE_PREFIX, openconnection)
+            seconds = timecall(MyAssignment.roundrobinpartition, ratingstablename, n, openconnection, mode=mode)
+            results.append({'function': 'roundrobinpartition', 'mode': mode, 'partitions': n, 'seconds': seconds})
+    droppartitions(RROBIN_TABLE_PREFIX, openconnection)
+    return results
+
+
+def benchmarkloadratings(ratingstablename, ratingsfilepath, openconnection, rowmode=False):
+    """
+    Times the loadratings modes, loadandpartition and the parallel loader on the same file
+    :param rowmode: Also time the one-INSERT-per-line mode, which takes hours at 1e7+ rows
+    :return: One result dict per loader, including rows/sec
+    """
+    results = []
+    for mode in (('row',) if rowmode else ()) + ('batch', 'infile'):
+        stats = MyAssignment.loadratings(ratingstablename, ratingsfilepath, openconnection, mode=mode)
+        results.append({'function': 'loadratings', 'mode': mode, 'seconds': stats['seconds'],
+                        'rows_per_sec': stats['rows_per_sec']})
+    stats = MyAssignment.loadandpartition(ratingstablename, ratingsfilepath, openconnection,
+                                          rangepartitions=5, roundrobinpartitions=5)
+    results.append({'function': 'loadandpartition', 'mode': 'range+roundrobin', 'partitions': 5,
+                    'seconds': stats['seconds'], 'rows_per_sec': stats['rows_per_sec']})
+    stats = MyAssignment.parallelloadratings(ratingstablename, ratingsfilepath, openconnection)
+    results.append({'function': 'parallelloadratings', 'mode': 'parallel', 'seconds': stats['seconds'],
+                    'rows_per_sec': stats['rows_per_sec']})
+    return results
+
+
+def _insertrows(count, seed):
+    rng = random.Random(seed)
+    return [(10 ** 9 + i, rng.randint(1, 1000), rng.choice(RATING_VALUES)) for i in range(count)]
+
+
+def benchmarkinserts(ratingstablename, partitioncounts, inserts, openconnection):
+    """
+    Times single-row, batched and write-behind buffered range and round robin inserts after partitioning
+    :param inserts: Number of rows inserted by every variant
+    :return: One result dict per (function, partition count)
+    """
+    results = []
+    for n in partitioncounts:
+        MyAssignment.rangepartition(ratingstablename, n, openconnection)
+        MyAssignment.roundrobinpartition(ratingstablename, n, openconnection)
+        for name, single, many, scheme in (
+                ('rangeinsert', MyAssignment.rangeinsert, MyAssignment.rangeinsert_many, 'range'),
+                ('roundrobininsert', MyAssignment.roundrobininsert, MyAssignment.roundrobininsert_many,
+                 'roundrobin')):
+            rows = _insertrows(inserts, n)
+            start = time.time()
+            for userid, movieid, rating in rows:
+                single(ratingstablename, userid, movieid, rating, openconnection)
+            seconds = time.time() - start
+            results.append({'function': name, 'mode': 'single', 'partitions': n, 'rows': inserts,
+                            'seconds': seconds, 'rows_per_sec': inserts / seconds if seconds else None})
+            seconds = timecall(many, ratingstablename, _insertrows(inserts, n + 1), openconnection)
+            results.append({'function': name + '_many', 'mode': 'batch', 'partitions': n, 'rows': inserts,
+                            'seconds': seconds, 'rows_per_sec': inserts / seconds if seconds else None})
+            # Group commit only pays off with concurrent callers, a single loop would just wait out maxdelay
+            start = time.time()
+            with bufferedWriter.BufferedWriter(ratingstablename, openconnection, scheme,
+                                               bufferedWriter.ASYNC) as writer:
+                for userid, movieid, rating in _insertrows(inserts, n + 2):
+                    writer.insert(userid, movieid, rating)
+            seconds = time.time() - start
+            results.append({'function': name, 'mode': 'buffered', 'partitions': n, 'rows': inserts,
+                            'seconds': seconds, 'rows_per_sec': inserts / seconds if seconds else None})
+    droppartitions(RANGE_TABLE_PREFIX, openconnection)
+    droppartitions(RROBIN_TABLE_PREFIX, openconnection)
+    return results
+
+
+def benchmarkqueries(ratingstablename, partitioncounts, openconnection):
+    """
+    Times a narrow and a full range query and a point query over range and round robin partitions
+    :return: One result dict per (query, partition count)
+    """
+    results = []
+    for n in partitioncounts:
+        MyAssignment.rangepartition(ratingstablename, n, openconnection)
+        MyAssignment.roundrobinpartition(ratingstablename, n, openconnection)
+        for name, query, args in (('rangequery', partitionQuery.rangequery, (3.5, 3.5)),
+                                  ('rangequery', partitionQuery.rangequery, (0, 5)),
+                                  ('pointquery', partitionQuery.pointquery, (4,))):
+            start = time.time()
+            rows = sum(1 for _ in query(*(args + (openconnection,))))
+            results.append({'function': name, 'args': list(args), 'partitions': n, 'rows': rows,
+                            'seconds': time.time() - start})
+    droppartitions(RANGE_TABLE_PREFIX, openconnection)
+    droppartitions(RROBIN_TABLE_PREFIX, openconnection)
+    return results
+
+
+def runbenchmarks(ratingsfilepath, partitioncounts, inserts, openconnection, rowmode=False):
+    results = benchmarkloadratings(RATINGS_TABLE, ratingsfilepath, openconnection, rowmode)
+    results += benchmarkrangepartition(RATINGS_TABLE, partitioncounts, openconnection)
+    results += benchmarkroundrobinpartition(RATINGS_TABLE, partitioncounts, openconnection)
+    results += benchmarkinserts(RATINGS_TABLE, partitioncounts, inserts, openconnection)
+    results += benchmarkqueries(RATINGS_TABLE, partitioncounts, openconnection)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark loading, partitioning, inserts and queries')
+    parser.add_argument('--input', help='Existing ratings file; a synthetic one is generated when omitted')
+    parser.add_argument('--rows', type=int, default=10000, help='Rows to generate (1e4 to 1e8)')
+    parser.add_argument('--skew', type=float, default=1.0, help='Rating and movie popularity skew, 0 = uniform')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--partitions', type=int, nargs='+', default=[5, 50, 500])
+    parser.add_argument('--inserts', type=int, default=1000, help='Rows inserted by each insert benchmark')
+    parser.add_argument('--row-mode', action='store_true',
+                        help="Also time loadratings(mode='row'); only practical for small inputs")
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    ratingsfilepath = args.input
+    if ratingsfilepath is None:
+        ratingsfilepath = os.path.join(tempfile.gettempdir(), 'ratings_{0}_{1:g}_{2}.dat'.format(
+            args.rows, args.skew, args.seed))
+        if not os.path.exists(ratingsfilepath):
+            generateratings(ratingsfilepath, args.rows, skew=args.skew, seed=args.seed)
+
+    testHelper.createdb(DATABASE_NAME)
+    with testHelper.getopenconnection(dbname=DATABASE_NAME) as conn:
+        report = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'input': ratingsfilepath,
+            'rows': args.rows if args.input is None else None,
+            'skew': args.skew if args.input is None else None,
+            'partitions': args.partitions,
+            'results': runbenchmarks(ratingsfilepath, args.partitions, args.inserts, conn, args.row_mode)
+        }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,193 @@
+#
+# Write-behind buffer for rangeinsert/roundrobininsert: rows are grouped and committed in batches
+#
+import atexit
+import threading
+import time
+
+import Interface
+
+SYNC = 'sync'
+GROUP = 'group'
+ASYNC = 'async'
+MAX_ROWS = 1000
+MAX_DELAY = 0.01
+
+_INSERTS = {
+    'range': Interface.rangeinsert_many,
+    'roundrobin': Interface.roundrobininsert_many
+}
+
+
+class _Ticket(object):
+    # Signalled once the batch holding a caller's rows has been committed or rolled back
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class BufferedWriter(object):
+    """
+    Queues ratings in memory and inserts them through rangeinsert_many/roundrobininsert_many, so a whole
+    batch costs one transaction and one commit instead of one per row.
+    A batch is flushed once it holds maxrows rows or its oldest row has waited maxdelay seconds.
+    Durability:
+        sync  - every call is inserted and committed before it returns, no buffering
+        group - calls wait until the batch holding their rows is committed, concurrent callers share it
+        async - calls return at once; a failed batch is rolled back and its error raised by the next call
+    Buffered rows are flushed by flush(), close(), leaving a with block, or at interpreter exit.
+    :param scheme: 'range' or 'roundrobin'
+    :param maxpending: Callers block while this many rows are waiting, so memory stays bounded
+    :param connectionfactory: Opens the flusher's own connection, defaults to the pool of openconnection
+    """
+
+    def __init__(self, ratingstablename, openconnection, scheme='range', durability=GROUP, maxrows=MAX_ROWS,
+                 maxdelay=MAX_DELAY, maxpending=None, connectionfactory=None):
+        if scheme not in _INSERTS:
+            raise ValueError("Unknown partitioning scheme: " + str(scheme))
+        if durability not in (SYNC, GROUP, ASYNC):
+            raise ValueError("Unknown durability mode: " + str(durability))
+        self.ratingstablename = ratingstablename
+        self.durability = durability
+        self.maxrows = maxrows
+        self.maxdelay = maxdelay
+        self.maxpending = maxpending or 10 * maxrows
+        self._insert = _INSERTS[scheme]
+        self._connection = (connectionfactory or Interface._connectionfactory(openconnection))()
+        # Checked up front so one bad rating cannot roll back everybody else's rows in its batch
+        self._maxrating = Interface._rangetarget(self._connection)[0][-1] if scheme == 'range' else None
+
+        self._lock = threading.Condition()
+        self._pending = []
+        self._tickets = []
+        self._oldest = None
+        self._flushnow = False
+        self._error = None
+        self._closed = False
+        self._flusher = None
+        if durability != SYNC:
+            self._flusher = threading.Thread(target=self._run, name='bufferedwriter')
+            self._flusher.daemon = True
+            self._flusher.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def insert(self, userid, itemid, rating):
+        self.insert_many([(userid, itemid, rating)])
+
+    def insert_many(self, rows):
+        rows = [(userid, itemid, rating) for userid, itemid, rating in rows]
+        if not rows:
+            return
+        if self._maxrating is not None:
+            for row in rows:
+                if not 0 <= row[2] <= self._maxrating:
+                    raise ValueError("Rating " + str(row[2]) + " is outside every range partition")
+
+        if self.durability == SYNC:
+            with self._lock:
+                self._raiseerror()
+                self._insert(self.ratingstablename, rows, self._connection)
+            return
+
+        ticket = _Ticket() if self.durability == GROUP else None
+        with self._lock:
+            self._raiseerror()
+            while len(self._pending) >= self.maxpending and not self._closed:
+                self._lock.wait()
+            if self._closed:
+                raise ValueError("BufferedWriter is closed")
+            if not self._pending:
+                self._oldest = time.time()
+            self._pending.extend(rows)
+            if ticket is not None:
+                self._tickets.append(ticket)
+            self._lock.notify_all()
+        if ticket is not None:
+            ticket.wait()
+
+    def flush(self):
+        """
+        Commits every row queued so far, whatever the durability mode
+        """
+        if self._flusher is None:
+            with self._lock:
+                self._raiseerror()
+            return
+        ticket = _Ticket()
+        with self._lock:
+            if self._closed:
+                self._raiseerror()
+                return
+            self._tickets.append(ticket)
+            self._flushnow = True
+            self._lock.notify_all()
+        ticket.wait()
+        with self._lock:
+            self._raiseerror()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lock.notify_all()
+        atexit.unregister(self.close)
+        if self._flusher is not None:
+            self._flusher.join()
+        self._connection.close()
+        with self._lock:
+            self._raiseerror()
+
+    def _raiseerror(self):
+        # Async failures are reported once, to whoever calls next
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _nextbatch(self):
+        # Waits for a size or time threshold, a flush request or close; None once closed and drained
+        with self._lock:
+            while not self._pending and not self._tickets:
+                if self._closed:
+                    return None
+                self._lock.wait()
+            while len(self._pending) < self.maxrows and not self._flushnow and not self._closed:
+                remaining = self._oldest + self.maxdelay - time.time() if self._pending else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            rows, self._pending = self._pending, []
+            tickets, self._tickets = self._tickets, []
+            self._flushnow = False
+            self._lock.notify_all()
+            return rows, tickets
+
+    def _run(self):
+        while True:
+            batch = self._nextbatch()
+            if batch is None:
+                return
+            rows, tickets = batch
+            error = None
+            try:
+                if rows:
+                    self._insert(self.ratingstablename, rows, self._connection)
+            except Exception as e:
+                error = e
+            if error is not None and self.durability == ASYNC and not tickets:
+                with self._lock:
+                    self._error = error
+            for ticket in tickets:
+                ticket.error = error
+                ticket.event.set()
@@ -0,0 +1,249 @@
+#
+# Pooled MySQL connections shared by Interface and testHelper
+#
+import os
+import threading
+import time
+import weakref
+from collections import deque
+
+import mysql.connector
+
+POOL_SIZE = 8
+MAX_IDLE_SECONDS = 300
+HEALTHCHECK_AFTER_SECONDS = 30
+WAIT_TIMEOUT_SECONDS = 30
+
+_pools = {}
+_poolslock = threading.Lock()
+# Settings of plain (unpooled) connections, worked out once per connection by configof
+_configs = weakref.WeakKeyDictionary()
+
+
+def dbconfig(user=None, password=None, dbname=None, host=None, port=None, localinfile=None):
+    """
+    Builds connection settings; explicit arguments win over the MYSQL_* environment variables
+    :param localinfile: Allows LOAD DATA LOCAL INFILE: True for any file, or a directory to allow only the
+                        files in it. MYSQL_LOCAL_INFILE takes 1 or a directory. Off by default.
+    :return: Keyword arguments for mysql.connector.connect
+    """
+    config = {
+        'host': host or os.environ.get('MYSQL_HOST', 'localhost'),
+        'port': int(port or os.environ.get('MYSQL_PORT', 3306)),
+        'user': user or os.environ.get('MYSQL_USER', 'root'),
+        'password': password if password is not None else os.environ.get('MYSQL_PASSWORD', '123456'),
+        'database': dbname or os.environ.get('MYSQL_DATABASE', 'mysql')
+    }
+    if localinfile is None:
+        localinfile = os.environ.get('MYSQL_LOCAL_INFILE') or None
+        if localinfile in ('1', 'true', 'yes'):
+            localinfile = True
+    if localinfile is True:
+        config['allow_local_infile'] = True
+    elif localinfile:
+        config['allow_local_infile_in_path'] = localinfile
+    return config
+
+
+class PooledConnection(object):
+    """
+    Wraps a mysql.connector connection; close() hands it back to the pool instead of closing it
+    """
+
+    def __init__(self, pool, connection):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_connection', connection)
+
+    @property
+    def pool(self):
+        return self._pool
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection, name, value)
+
+    def close(self):
+        connection = self._connection
+        if connection is not None:
+            object.__setattr__(self, '_connection', None)
+            self._pool.release(connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ConnectionPool(object):
+    """
+    Bounded pool of MySQL connections with health checks, idle recycling and wait-time stats
+    :param size: Maximum number of open connections
+    :param maxidle: Connections idle for longer than this many seconds are closed and reopened
+    :param healthcheckafter: Connections idle for longer than this many seconds are pinged before reuse
+    :param timeout: Default number of seconds getconnection waits for a free connection
+    :param config: Connection settings, see dbconfig
+    """
+
+    def __init__(self, size=POOL_SIZE, maxidle=MAX_IDLE_SECONDS, healthcheckafter=HEALTHCHECK_AFTER_SECONDS,
+                 timeout=WAIT_TIMEOUT_SECONDS, **config):
+        self.size = size
+        self.timeout = timeout
+        self.maxidle = maxidle
+        self.healthcheckafter = healthcheckafter
+        self.config = config
+        self._idle = deque()
+        self._open = 0
+        self._inuse = 0
+        self._cond = threading.Condition()
+        self._borrows = 0
+        self._waited = 0.0
+        self._maxwait = 0.0
+        self._recycled = 0
+
+    def _connect(self):
+        return mysql.connector.connect(**self.config)
+
+    def _checkout(self, connection, idlesince):
+        idle = time.time() - idlesince
+        try:
+            if idle > self.maxidle:
+                connection.close()
+                self._recycled += 1
+                return self._connect()
+            if idle > self.healthcheckafter:
+                connection.ping(reconnect=True, attempts=1, delay=0)
+            return connection
+        except mysql.connector.Error:
+            self._recycled += 1
+            return self._connect()
+
+    def getconnection(self, timeout=None):
+        start = time.time()
+        timeout = self.timeout if timeout is None else timeout
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                remaining = None if timeout is None else timeout - (time.time() - start)
+                if remaining is not None and remaining <= 0:
+                    raise mysql.connector.errors.PoolError('Timed out waiting for a pooled connection')
+                self._cond.wait(remaining)
+            if self._idle:
+                connection, idlesince = self._idle.pop()
+            else:
+                connection, idlesince = None, None
+                self._open += 1
+            self._inuse += 1
+            waited = time.time() - start
+            self._borrows += 1
+            self._waited += waited
+            self._maxwait = max(self._maxwait, waited)
+
+        try:
+            if connection is None:
+                connection = self._connect()
+            else:
+                connection = self._checkout(connection, idlesince)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._inuse -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, connection)
+
+    def release(self, connection):
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+            connection.autocommit = False
+        except mysql.connector.Error:
+            connection = None
+        with self._cond:
+            self._inuse -= 1
+            if connection is None:
+                self._open -= 1
+            else:
+                self._idle.append((connection, time.time()))
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'inuse': self._inuse,
+                'idle': len(self._idle),
+                'utilization': float(self._inuse) / self.size,
+                'borrows': self._borrows,
+                'total_wait_seconds': self._waited,
+                'avg_wait_seconds': self._waited / self._borrows if self._borrows else 0.0,
+                'max_wait_seconds': self._maxwait,
+                'recycled': self._recycled
+            }
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                connection, _ = self._idle.pop()
+                connection.close()
+                self._open -= 1
+
+
+def getpool(user=None, password=None, dbname=None, host=None, port=None, localinfile=None):
+    """
+    Returns the shared pool for these connection settings, creating it on first use
+    """
+    config = dbconfig(user, password, dbname, host, port, localinfile)
+    key = tuple(sorted(config.items()))
+    with _poolslock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(size=int(os.environ.get('MYSQL_POOL_SIZE', POOL_SIZE)), **config)
+            _pools[key] = pool
+    return pool
+
+
+def configof(connection):
+    """
+    Connection settings of an open connection.
+    A pooled connection reports its pool's settings. For a plain connection the current database is asked
+    for once and remembered for the life of the connection (MySQLConnection.database runs SELECT DATABASE()
+    on every access), so switch databases on a new connection rather than with USE.
+    :return: Dict like dbconfig
+    :raises ValueError: The connection has no current database
+    """
+    if isinstance(connection, PooledConnection):
+        return connection.pool.config
+    with _poolslock:
+        config = _configs.get(connection)
+    if config is None:
+        database = connection.database
+        if not database:
+            raise ValueError("The connection has no current database; connect with one or run USE first")
+        config = {
+            'host': connection.server_host,
+            'port': connection.server_port,
+            'user': connection.user,
+            'password': connection._password,
+            'database': database
+        }
+        with _poolslock:
+            _configs[connection] = config
+    return config
+
+
+def poolof(connection):
+    """
+    The pool connection was borrowed from, or the shared pool for its settings, so extra connections for
+    worker threads use the caller's host and credentials
+    """
+    if isinstance(connection, PooledConnection):
+        return connection.pool
+    config = configof(connection)
+    return getpool(config['user'], config['password'], config['database'], config['host'], config['port'])
+
+
+def getconnection(user=None, password=None, dbname=None, host=None, port=None):
+    return getpool(user, password, dbname, host, port).getconnection()
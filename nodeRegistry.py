@@ -0,0 +1,436 @@
+#
+# Partition tables spread over several MySQL instances, with routing for partitioning, inserts and queries
+#
+import os
+import re
+
+import mysql.connector
+
+import connectionPool
+import Interface
+import partitionQuery
+import statementProfiler
+
+NODES_TABLE = 'partition_nodes'
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+HASH_TABLE_PREFIX = 'hash_part'
+
+_registries = {}
+
+
+def parsenodes(spec, dbname=None):
+    """
+    Parses a comma separated list of host:port or host:port/dbname endpoints, e.g. MYSQL_NODES
+    :return: List of {'host', 'port', 'dbname'} dicts; dbname falls back to the given one
+    """
+    nodes = []
+    for endpoint in spec.split(','):
+        endpoint = endpoint.strip()
+        if not endpoint:
+            continue
+        address, _, database = endpoint.partition('/')
+        host, _, port = address.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError("Node endpoints look like host:port[/dbname], got " + endpoint)
+        nodes.append({'host': host, 'port': int(port), 'dbname': database or dbname})
+    return nodes
+
+
+class NodeRegistry(object):
+    """
+    The MySQL instances holding partition tables and which table lives on which of them.
+    Placement is stored in partition_nodes on the coordinator (the database of openconnection, which also
+    keeps the master table and the catalog), so every client opening a registry there routes the same way.
+    The registry keeps no connection of its own, so it can be shared; use getregistry for the cached one.
+    :param nodes: Endpoints as accepted by parsenodes, or a list of node dicts; defaults to MYSQL_NODES, and
+                  to the coordinator alone when that is unset
+    """
+
+    def __init__(self, openconnection, nodes=None):
+        self.config = connectionPool.configof(openconnection)
+        self.coordinator = {'host': self.config['host'], 'port': self.config['port'],
+                            'dbname': self.config['database']}
+        self._coordinatorfactory = Interface._connectionfactory(openconnection)
+        if nodes is None:
+            nodes = os.environ.get('MYSQL_NODES', '')
+        if isinstance(nodes, str):
+            nodes = parsenodes(nodes, self.config['database'])
+        self.nodes = [dict(node, dbname=node.get('dbname') or self.config['database']) for node in nodes]
+        if not self.nodes:
+            self.nodes = [self.coordinator]
+        self._placement = None
+
+    def place(self, tablenames):
+        """
+        Puts table i on node i mod (number of nodes) and records it on the coordinator
+        :return: List of the node dicts, parallel to tablenames
+        """
+        placed = [self.nodes[i % len(self.nodes)] for i in range(len(tablenames))]
+        con = self._coordinatorfactory()
+        try:
+            cur = statementProfiler.cursor(con)
+            cur.execute("CREATE TABLE IF NOT EXISTS " + NODES_TABLE +
+                        " (tablename VARCHAR(64) PRIMARY KEY, host VARCHAR(255), port INTEGER, dbname VARCHAR(64))")
+            cur.executemany("REPLACE INTO " + NODES_TABLE + " (tablename, host, port, dbname) VALUES (%s, %s, %s, %s)",
+                            [(tablename, node['host'], node['port'], node['dbname'])
+                             for tablename, node in zip(tablenames, placed)])
+            cur.close()
+            con.commit()
+        finally:
+            con.close()
+        self._placement = None
+        return placed
+
+    def unplace(self, tablenames):
+        # Forgets tables that no longer exist, so they are neither routed to nor scanned
+        if not tablenames:
+            return
+        con = self._coordinatorfactory()
+        try:
+            cur = statementProfiler.cursor(con)
+            cur.executemany("DELETE FROM " + NODES_TABLE + " WHERE tablename = %s", [(t,) for t in tablenames])
+            cur.close()
+            con.commit()
+        finally:
+            con.close()
+        self._placement = None
+
+    def reload(self, openconnection=None):
+        # Placement is read once; another process re-partitioning onto other nodes needs a reload
+        self._placement = None
+        if openconnection is not None:
+            self._load(openconnection)
+
+    def _load(self, openconnection=None):
+        # Reads through openconnection when given, so a caller holding the last pooled connection never
+        # waits for another one
+        if self._placement is None:
+            con = openconnection or self._coordinatorfactory()
+            try:
+                cur = statementProfiler.cursor(con)
+                cur.execute("SELECT tablename, host, port, dbname FROM " + NODES_TABLE)
+                self._placement = dict((row[0], {'host': row[1], 'port': row[2], 'dbname': row[3]})
+                                       for row in cur.fetchall())
+                cur.close()
+            except mysql.connector.Error:
+                self._placement = {}
+            finally:
+                if con is not openconnection:
+                    con.close()
+        return self._placement
+
+    def node(self, tablename):
+        # None for tables that were never placed; those stay on the coordinator
+        return self._load().get(tablename)
+
+    def placed(self, prefix):
+        return [tablename for tablename in self._load() if tablename.startswith(prefix)]
+
+    def iscoordinator(self, node):
+        return node is None or node == self.coordinator
+
+    def connectionfactory(self, tablename):
+        node = self.node(tablename)
+        if self.iscoordinator(node):
+            return self._coordinatorfactory
+        # Nodes are reached with the coordinator's credentials
+        return connectionPool.getpool(self.config['user'], self.config['password'], node['dbname'], node['host'],
+                                      node['port']).getconnection
+
+    def bynode(self, tablenames):
+        """
+        Groups tables by the node holding them
+        :return: List of (connectionfactory, tablenames)
+        """
+        groups = {}
+        for tablename in tablenames:
+            groups.setdefault(self.connectionfactory(tablename), []).append(tablename)
+        return list(groups.items())
+
+
+def getregistry(openconnection, nodes=None):
+    """
+    The registry of openconnection's coordinator, built once per process for each coordinator and node list
+    instead of on every call
+    """
+    config = connectionPool.configof(openconnection)
+    if nodes is None:
+        nodes = os.environ.get('MYSQL_NODES', '')
+    key = (config['host'], config['port'], config['database'], repr(nodes))
+    registry = _registries.get(key)
+    if registry is None:
+        registry = _registries.setdefault(key, NodeRegistry(openconnection, nodes))
+    registry._load(openconnection)
+    return registry
+
+
+def _createtables(registry, tablenames, layout):
+    for connectionfactory, tables in registry.bynode(tablenames):
+        con = connectionfactory()
+        try:
+            cur = statementProfiler.cursor(con)
+            for tablename in tables:
+                cur.execute("DROP TABLE IF EXISTS " + tablename)
+                Interface._createratingstable(cur, tablename, layout)
+            cur.close()
+            con.commit()
+        finally:
+            con.close()
+
+
+def _buildindexes(registry, tablenames, layout):
+    for connectionfactory, tables in registry.bynode(tablenames):
+        con = connectionfactory()
+        try:
+            Interface._buildindexes(con, tables, layout)
+        finally:
+            con.close()
+
+
+def _insertgroups(registry, groups, openconnection):
+    # Tables on the coordinator are written through openconnection, inside the caller's transaction, so a
+    # caller never waits on its own pool for a second connection. Every other node commits its own rows;
+    # a failure part-way leaves the nodes already done committed.
+    local = [t for t in groups if registry.iscoordinator(registry.node(t))]
+    if local:
+        cur = statementProfiler.cursor(openconnection)
+        Interface._insertgroups(cur, dict((tablename, groups[tablename]) for tablename in local))
+        cur.close()
+    for connectionfactory, tables in registry.bynode([t for t in groups if t not in local]):
+        con = connectionfactory()
+        try:
+            cur = statementProfiler.cursor(con)
+            Interface._insertgroups(cur, dict((tablename, groups[tablename]) for tablename in tables))
+            cur.close()
+            con.commit()
+        finally:
+            con.close()
+
+
+def _dropstale(registry, prefix, tablenames, openconnection):
+    # An earlier partitioning may have left prefixN tables behind: local ones on the coordinator, which the
+    # table-counting fallbacks would still find, and placed ones beyond the new count on any node
+    stale = [t for t in registry.placed(prefix) if t not in tablenames]
+    for connectionfactory, tables in registry.bynode(stale):
+        con = connectionfactory()
+        try:
+            cur = statementProfiler.cursor(con)
+            for tablename in tables:
+                cur.execute("DROP TABLE IF EXISTS " + tablename)
+            cur.close()
+            con.commit()
+        finally:
+            con.close()
+    registry.unplace(stale)
+
+    cur = statementProfiler.cursor(openconnection)
+    cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name LIKE %s",
+                (prefix + '%',))
+    pattern = re.compile(re.escape(prefix) + r'\d+$')
+    for (tablename,) in cur.fetchall():
+        if pattern.match(tablename) and (tablename not in tablenames or
+                                         not registry.iscoordinator(registry.node(tablename))):
+            cur.execute("DROP TABLE IF EXISTS " + tablename)
+    cur.close()
+    openconnection.commit()
+
+
+def _partition(prefix, selectsql, tablenames, route, openconnection, registry, numberofwriters, layout):
+    registry.place(tablenames)
+    _dropstale(registry, prefix, tablenames, openconnection)
+    _createtables(registry, tablenames, layout)
+    counts = Interface._routerows(selectsql, openconnection, tablenames, route, None, numberofwriters,
+                                  tablefactories=[registry.connectionfactory(t) for t in tablenames])
+    _buildindexes(registry, tablenames, layout)
+    return counts
+
+
+@statementProfiler.instrumented
+def rangepartition(ratingstablename, numberofpartitions, openconnection, registry=None, numberofwriters=4,
+                   layout=None):
+    """
+    Range partitions the master table on the coordinator into range_partN tables spread over the nodes
+    :param numberofwriters: Writers per node
+    """
+    registry = registry or getregistry(openconnection)
+    tablenames = [RANGE_TABLE_PREFIX + str(i) for i in range(numberofpartitions)]
+    bounds = Interface._rangebounds(numberofpartitions)
+    Interface.savecatalog('range', RANGE_TABLE_PREFIX, ratingstablename, numberofpartitions, openconnection,
+                          boundaries=bounds)
+    _partition(RANGE_TABLE_PREFIX, "SELECT userid, movieid, rating FROM " + ratingstablename, tablenames,
+               lambda row: Interface._rangeindex(row[2], bounds), openconnection, registry, numberofwriters, layout)
+
+
+@statementProfiler.instrumented
+def roundrobinpartition(ratingstablename, numberofpartitions, openconnection, registry=None, numberofwriters=4,
+                        layout=None):
+    """
+    Round robin partitions the master table on the coordinator into rrobin_partN tables spread over the nodes
+    :param numberofwriters: Writers per node
+    """
+    registry = registry or getregistry(openconnection)
+    tablenames = [RROBIN_TABLE_PREFIX + str(i) for i in range(numberofpartitions)]
+    counts = _partition(RROBIN_TABLE_PREFIX, "SELECT userid, movieid, rating FROM " + ratingstablename +
+                        " ORDER BY userid ASC", tablenames, Interface._roundrobinroute(numberofpartitions),
+                        openconnection, registry, numberofwriters, layout)
+    Interface.savecatalog('roundrobin', RROBIN_TABLE_PREFIX, ratingstablename, numberofpartitions, openconnection,
+                          nextslot=sum(counts))
+
+
+@statementProfiler.instrumented
+def hashpartition(ratingstablename, column, numberofpartitions, openconnection, registry=None, numberofwriters=4,
+                  layout=None):
+    """
+    Hash partitions the master table on the coordinator by column into hash_partN tables spread over the nodes
+    :param column: One of Interface.HASH_COLUMNS
+    :param numberofwriters: Writers per node
+    """
+    if column not in Interface.HASH_COLUMNS:
+        raise ValueError("Hash partitioning needs one of " + ', '.join(Interface.HASH_COLUMNS) + ", got " +
+                         str(column))
+    if not isinstance(numberofpartitions, int) or numberofpartitions <= 0:
+        raise ValueError("Number of partitions must be a positive integer")
+    registry = registry or getregistry(openconnection)
+    tablenames = [HASH_TABLE_PREFIX + str(i) for i in range(numberofpartitions)]
+    position = Interface.HASH_COLUMNS.index(column)
+    Interface.savecatalog('hash', HASH_TABLE_PREFIX, ratingstablename, numberofpartitions, openconnection,
+                          partitionkey=column)
+    _partition(HASH_TABLE_PREFIX, "SELECT userid, movieid, rating FROM " + ratingstablename, tablenames,
+               lambda row: Interface._hashindex(row[position], numberofpartitions), openconnection, registry,
+               numberofwriters, layout)
+
+
+def _insertmaster(ratingstablename, rows, openconnection):
+    cur = statementProfiler.cursor(openconnection)
+    cur.executemany("INSERT INTO " + ratingstablename + " (userid, movieid, rating) VALUES (%s, %s, %s)", rows)
+    cur.close()
+
+
+@statementProfiler.instrumented
+def rangeinsert(ratingstablename, userid, itemid, rating, openconnection, registry=None):
+    rangeinsert_many(ratingstablename, [(userid, itemid, rating)], openconnection, registry)
+
+
+def _insertrouted(ratingstablename, rows, openconnection, registry, scheme, groupsof):
+    # groupsof(rows, con) routes with the cached catalog; if another process repartitioned since, the
+    # rows are routed again and the placement reloaded
+    con = openconnection
+    groups = groupsof(rows, con)
+
+    Interface._begin(con)
+    cur = statementProfiler.cursor(con)
+    try:
+        if not Interface._catalogcurrent(cur, scheme, con):
+            registry.reload(con)
+            groups = groupsof(rows, con)
+        _insertmaster(ratingstablename, rows, con)
+        _insertgroups(registry, groups, con)
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+    con.commit()
+
+
+@statementProfiler.instrumented
+def rangeinsert_many(ratingstablename, rows, openconnection, registry=None):
+    """
+    Inserts into the master table on the coordinator and into the range partitions on their nodes.
+    Rows for other nodes are committed first and rows on the coordinator together with the master table,
+    so the master table never holds a row its partition lacks.
+    """
+    rows = [(userid, itemid, rating) for userid, itemid, rating in rows]
+    if not rows:
+        return
+    _insertrouted(ratingstablename, rows, openconnection, registry or getregistry(openconnection), 'range',
+                  Interface._rangegroups)
+
+
+@statementProfiler.instrumented
+def roundrobininsert(ratingstablename, userid, itemid, rating, openconnection, registry=None):
+    roundrobininsert_many(ratingstablename, [(userid, itemid, rating)], openconnection, registry)
+
+
+@statementProfiler.instrumented
+def roundrobininsert_many(ratingstablename, rows, openconnection, registry=None):
+    """
+    Inserts into the master table on the coordinator and into the round robin partitions on their nodes.
+    Slots come from the coordinator's sequence, so concurrent clients stay balanced across nodes.
+    """
+    con = openconnection
+    rows = [(userid, itemid, rating) for userid, itemid, rating in rows]
+    if not rows:
+        return
+    registry = registry or getregistry(con)
+    target = Interface._reserveslots(len(rows), con)
+    Interface._begin(con)
+    cur = statementProfiler.cursor(con)
+    try:
+        _insertmaster(ratingstablename, rows, con)
+        slot, numberofpartitions, prefix = target or Interface._countslots(cur, ratingstablename, len(rows), con)
+        groups = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(prefix + str((slot + i) % numberofpartitions), []).append(row)
+        _insertgroups(registry, groups, con)
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+    con.commit()
+
+
+@statementProfiler.instrumented
+def hashinsert(ratingstablename, userid, itemid, rating, openconnection, registry=None):
+    hashinsert_many(ratingstablename, [(userid, itemid, rating)], openconnection, registry)
+
+
+@statementProfiler.instrumented
+def hashinsert_many(ratingstablename, rows, openconnection, registry=None):
+    """
+    Inserts into the master table on the coordinator and into the hash partitions on their nodes.
+    Rows for other nodes are committed first and rows on the coordinator together with the master table,
+    so the master table never holds a row its partition lacks.
+    """
+    rows = [(userid, itemid, rating) for userid, itemid, rating in rows]
+    if not rows:
+        return
+    _insertrouted(ratingstablename, rows, openconnection, registry or getregistry(openconnection), 'hash',
+                  Interface._hashgroups)
+
+
+def rangequery(ratingminvalue, ratingmaxvalue, openconnection, registry=None):
+    """
+    Streams every rating with ratingminvalue <= rating <= ratingmaxvalue, scanning all nodes in parallel
+    :return: Generator of (partition name, userid, movieid, rating)
+    """
+    registry = registry or getregistry(openconnection)
+    tables = (partitionQuery._rangetables(ratingminvalue, ratingmaxvalue, openconnection) +
+              partitionQuery._roundrobintables(openconnection))
+    return partitionQuery._fanoutgroups(registry.bynode(tables), "rating >= %s AND rating <= %s",
+                                        (ratingminvalue, ratingmaxvalue))
+
+
+def pointquery(ratingvalue, openconnection, registry=None):
+    """
+    Streams every rating equal to ratingvalue, scanning all nodes in parallel
+    :return: Generator of (partition name, userid, movieid, rating)
+    """
+    registry = registry or getregistry(openconnection)
+    tables = (partitionQuery._rangetables(ratingvalue, ratingvalue, openconnection) +
+              partitionQuery._roundrobintables(openconnection))
+    return partitionQuery._fanoutgroups(registry.bynode(tables), "rating = %s", (ratingvalue,))
+
+
+def hashlookup(key, openconnection, registry=None):
+    """
+    Streams every rating whose hash partitioning column equals key, reading only the fragment holding it
+    :return: Generator of (partition name, userid, movieid, rating)
+    """
+    registry = registry or getregistry(openconnection)
+    prefix, numberofpartitions, position = Interface._hashtarget(openconnection)
+    tablename = prefix + str(Interface._hashindex(key, numberofpartitions))
+    return partitionQuery._fanoutgroups([(registry.connectionfactory(tablename), [tablename])],
+                                        Interface.HASH_COLUMNS[position] + " = %s", (key,))
@@ -0,0 +1,256 @@
+#
+# Changing the number of range or hash partitions while inserts keep running
+#
+import mysql.connector
+
+import Interface
+import nodeRegistry
+import statementProfiler
+
+LOG_TABLE = 'repartition_log'
+SHADOW_SUFFIX = '_shadow'
+RETIRED_SUFFIX = '_retired'
+CATCHUP_ROUNDS = 5
+
+
+def _intervals(bounds):
+    # (lower, upper) for every partition; lower is None for the closed first interval [0, b0]
+    return [(bounds[i - 1] if i else None, upper) for i, upper in enumerate(bounds)]
+
+
+def _replaylog(cur, lastid, skipids, route, shadows, moved, position, batchsize):
+    # Copies the rows the triggers logged after the snapshot that belong in another partition into its shadow
+    cur.execute("SELECT id, source, userid, movieid, rating FROM " + LOG_TABLE + " WHERE id > %s ORDER BY id",
+                (lastid,))
+    logged = cur.fetchall()
+    groups = {}
+    for logid, source, userid, movieid, rating in logged:
+        lastid = logid
+        if logid in skipids:
+            continue
+        row = (userid, movieid, rating)
+        index = route(row)
+        if index is None or index == source:
+            continue
+        groups.setdefault(shadows[index], []).append(row)
+        if position is not None:
+            moved[source].add(row[position])
+    for tablename, rows in groups.items():
+        for i in range(0, len(rows), batchsize):
+            cur.executemany("INSERT INTO " + tablename + " (userid, movieid, rating) VALUES (%s, %s, %s)",
+                            rows[i:i + batchsize])
+    return lastid, sum(len(rows) for rows in groups.values())
+
+
+def _removemoved(cur, tablename, column, keys, batchsize):
+    # Deletes every row whose partition key moved elsewhere, batchsize keys per statement
+    keys = sorted(keys)
+    removed = 0
+    for i in range(0, len(keys), batchsize):
+        batch = keys[i:i + batchsize]
+        cur.execute("DELETE FROM " + tablename + " WHERE " + column + " IN (" + ", ".join(["%s"] * len(batch)) + ")",
+                    tuple(batch))
+        removed += cur.rowcount
+    return removed
+
+
+def _cleanup(cur, con, prefix, sources, shadows):
+    # Best effort after a failed repartition: stop logging inserts and drop the working tables, without
+    # hiding the error that got here
+    statements = ["DROP TRIGGER IF EXISTS " + prefix + str(i) + "_repartition" for i in sources]
+    statements += ["DROP TABLE IF EXISTS " + tablename for tablename in shadows]
+    statements.append("DROP TABLE IF EXISTS " + LOG_TABLE)
+    try:
+        con.rollback()
+    except mysql.connector.Error:
+        pass
+    for statement in statements:
+        try:
+            cur.execute(statement)
+        except mysql.connector.Error:
+            pass
+
+
+def _repartition(scheme, newpartitions, route, sources, targets, openconnection, boundaries=None, leaving=None,
+                 position=None, connectionfactory=None, numberofwriters=4, batchsize=Interface.BATCH_SIZE,
+                 layout=None):
+    # sources: old partitions that lose rows; targets: new partitions that gain rows.
+    # Only rows whose partition changes are copied, into one shadow per target. Leaving rows are found with
+    # the SQL condition leaving(i) where there is one, otherwise by route() and removed by their key column.
+    # Under the final lock, shadows of new partitions are renamed in, the others are merged into the existing
+    # partition, and the moved rows are deleted from their sources, so that work is proportional to the moves.
+    con = openconnection
+    catalog = Interface.getcatalog(scheme, con)
+    prefix, oldpartitions = catalog['prefix'], catalog['numberofpartitions']
+    # Triggers, LOCK TABLES and RENAME TABLE only reach the coordinator's own tables
+    registry = nodeRegistry.getregistry(con)
+    remote = [t for t in registry.placed(prefix) if not registry.iscoordinator(registry.node(t))]
+    if remote:
+        raise ValueError("Partitions placed on other nodes cannot be repartitioned online: " +
+                         ", ".join(sorted(remote)))
+    if not sources and not targets:
+        return {'copied': 0, 'replayed': 0, 'removed': 0, 'created': 0, 'dropped': 0}
+    shadows = [prefix + str(j) + SHADOW_SUFFIX if j in targets else None for j in range(newpartitions)]
+    created = [j for j in targets if j >= oldpartitions]
+    merged = [j for j in targets if j < oldpartitions]
+    dropped = [i for i in sources if i >= newpartitions]
+    kept = [i for i in sources if i < newpartitions]
+    moved = dict((i, set()) for i in sources)
+
+    cur = statementProfiler.cursor(con)
+    # Until the moves are committed a failure undoes everything; after that the shadows of new partitions
+    # hold rows already deleted from their sources, so they are kept for recovery
+    committed = False
+    try:
+        Interface._createcatalog(cur)
+        cur.execute("DROP TABLE IF EXISTS " + LOG_TABLE)
+        cur.execute("CREATE TABLE " + LOG_TABLE + " (id BIGINT AUTO_INCREMENT PRIMARY KEY, source INTEGER,"
+                    " userid INTEGER, movieid INTEGER, rating FLOAT)")
+        for j in targets:
+            cur.execute("DROP TABLE IF EXISTS " + shadows[j])
+            Interface._createratingstable(cur, shadows[j], layout)
+        # Inserts that keep landing in the source partitions are captured by the triggers and replayed below
+        for i in sources:
+            cur.execute("DROP TRIGGER IF EXISTS " + prefix + str(i) + "_repartition")
+            cur.execute("CREATE TRIGGER " + prefix + str(i) + "_repartition AFTER INSERT ON " + prefix + str(i) +
+                        " FOR EACH ROW INSERT INTO " + LOG_TABLE + " (source, userid, movieid, rating)"
+                        " VALUES (" + str(i) + ", NEW.userid, NEW.movieid, NEW.rating)")
+        con.commit()
+
+        # Log rows visible in the snapshot are also in the copied partitions, so they must not be replayed
+        con.start_transaction(consistent_snapshot=True)
+        cur.execute("SELECT id FROM " + LOG_TABLE)
+        skipids = set(row[0] for row in cur.fetchall())
+        copied = 0
+        for i in sources:
+            selectsql = "SELECT userid, movieid, rating FROM " + prefix + str(i)
+            if leaving is not None and i < newpartitions:
+                selectsql += " WHERE " + leaving(i)
+
+            def shadowroute(row, source=i):
+                index = route(row)
+                if index is None or index == source:
+                    return None
+                if position is not None:
+                    moved[source].add(row[position])
+                return index
+
+            copied += sum(Interface._routerows(selectsql, con, shadows, shadowroute, connectionfactory,
+                                               numberofwriters, batchsize))
+        con.commit()
+        Interface._buildindexes(con, [shadows[j] for j in created], layout)
+
+        lastid, replayed = 0, 0
+        for _ in range(CATCHUP_ROUNDS):
+            lastid, count = _replaylog(cur, lastid, skipids, route, shadows, moved, position, batchsize)
+            con.commit()
+            replayed += count
+            if count < batchsize:
+                break
+
+        locked = ([prefix + str(i) for i in sources] + [prefix + str(j) for j in merged] +
+                  [shadows[j] for j in targets] + [LOG_TABLE, Interface.CATALOG_TABLE])
+        cur.execute("LOCK TABLES " + ", ".join(name + " WRITE" for name in sorted(set(locked))))
+        removed = 0
+        try:
+            lastid, count = _replaylog(cur, lastid, skipids, route, shadows, moved, position, batchsize)
+            replayed += count
+            for j in merged:
+                cur.execute("INSERT INTO " + prefix + str(j) + " (userid, movieid, rating)"
+                            " SELECT userid, movieid, rating FROM " + shadows[j])
+            for i in kept:
+                if leaving is not None:
+                    cur.execute("DELETE FROM " + prefix + str(i) + " WHERE " + leaving(i))
+                    removed += cur.rowcount
+                else:
+                    removed += _removemoved(cur, prefix + str(i), Interface.HASH_COLUMNS[position], moved[i],
+                                            batchsize)
+            con.commit()
+            committed = True
+            for i in kept:
+                cur.execute("DROP TRIGGER IF EXISTS " + prefix + str(i) + "_repartition")
+            renames = [prefix + str(i) + " TO " + prefix + str(i) + RETIRED_SUFFIX for i in dropped]
+            renames += [shadows[j] + " TO " + prefix + str(j) for j in created]
+            if renames:
+                cur.execute("RENAME TABLE " + ", ".join(renames))
+            # The new version makes every process's next insert drop its cached entry and route again
+            cur.execute("UPDATE " + Interface.CATALOG_TABLE + " SET numberofpartitions = %s, boundaries = %s,"
+                        " version = version + 1 WHERE scheme = %s",
+                        (newpartitions, ','.join(repr(b) for b in boundaries) if boundaries else None, scheme))
+            con.commit()
+        finally:
+            cur.execute("UNLOCK TABLES")
+    except Exception:
+        _cleanup(cur, con, prefix, sources, [] if committed else [shadows[j] for j in targets])
+        raise
+    Interface.invalidatecatalog(scheme)
+
+    for i in dropped:
+        cur.execute("DROP TABLE IF EXISTS " + prefix + str(i) + RETIRED_SUFFIX)
+    for j in merged:
+        cur.execute("DROP TABLE IF EXISTS " + shadows[j])
+    cur.execute("DROP TABLE IF EXISTS " + LOG_TABLE)
+    cur.close()
+    con.commit()
+    return {'copied': copied, 'replayed': replayed, 'removed': removed, 'created': len(created),
+            'dropped': len(dropped)}
+
+
+@statementProfiler.instrumented
+def rangerepartition(numberofpartitions, openconnection, connectionfactory=None, numberofwriters=4,
+                     balanced=False, layout=None):
+    """
+    Moves the range partitions to numberofpartitions equal-width (or, with balanced, equal-depth)
+    intervals without taking them offline.
+    Only rows whose interval changes are moved: they are copied into shadow tables, then under one short lock
+    the shadows of new partitions are renamed in, the rest merged into their partition, and the moved rows
+    deleted from where they were.
+    :param layout: Storage layout of newly created partitions, see Interface.INDEXED_LAYOUT
+    :return: Dict with the rows copied, rows replayed from concurrent inserts, rows removed from kept
+             partitions, and partitions created and dropped
+    :raises ValueError: Some partition was placed on another node by nodeRegistry
+    """
+    catalog = Interface.getcatalog('range', openconnection)
+    if catalog is None:
+        raise ValueError("No range partitioning found; run rangepartition first")
+    oldintervals = _intervals(catalog['boundaries'])
+    if balanced:
+        histogram = Interface.ratinghistogram(catalog['sourcetable'], openconnection)
+        bounds = Interface._equidepthbounds(histogram, numberofpartitions)
+    else:
+        bounds = Interface._rangebounds(numberofpartitions)
+    newintervals = _intervals(bounds)
+    changed = [i for i in range(max(len(oldintervals), len(newintervals)))
+               if i >= len(oldintervals) or i >= len(newintervals) or oldintervals[i] != newintervals[i]]
+
+    def leaving(i):
+        lower, upper = newintervals[i]
+        return "rating > " + repr(upper) + (" OR rating <= " + repr(lower) if lower is not None else "")
+
+    return _repartition('range', numberofpartitions, lambda row: Interface._rangeindex(row[2], bounds),
+                        [i for i in changed if i < len(oldintervals)], [j for j in changed if j < len(newintervals)],
+                        openconnection, bounds, leaving, None, connectionfactory, numberofwriters, layout=layout)
+
+
+@statementProfiler.instrumented
+def hashrepartition(numberofpartitions, openconnection, connectionfactory=None, numberofwriters=4, layout=None):
+    """
+    Moves the hash partitions to numberofpartitions fragments without taking them offline.
+    With the jump consistent hash, growing from n to m fragments moves only the keys that now hash into
+    the m - n new ones (about 1 - n/m of the rows), and shrinking moves only the rows of the dropped ones.
+    :param layout: Storage layout of newly created partitions, see Interface.INDEXED_LAYOUT
+    :return: Dict with the rows copied, rows replayed from concurrent inserts, rows removed from kept
+             partitions, and partitions created and dropped
+    :raises ValueError: Some partition was placed on another node by nodeRegistry
+    """
+    _, oldpartitions, position = Interface._hashtarget(openconnection)
+    if numberofpartitions >= oldpartitions:
+        sources = list(range(oldpartitions)) if numberofpartitions > oldpartitions else []
+        targets = list(range(oldpartitions, numberofpartitions))
+    else:
+        sources = list(range(numberofpartitions, oldpartitions))
+        targets = list(range(numberofpartitions))
+
+    return _repartition('hash', numberofpartitions,
+                        lambda row: Interface._hashindex(row[position], numberofpartitions), sources, targets,
+                        openconnection, None, None, position, connectionfactory, numberofwriters, layout=layout)
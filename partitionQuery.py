@@ -0,0 +1,158 @@
+#
+# Range, point and hash key queries over the partition tables
+#
+import queue
+import threading
+
+import Interface
+import statementProfiler
+
+RANGE_TABLE_PREFIX = 'range_part'
+RROBIN_TABLE_PREFIX = 'rrobin_part'
+FETCH_SIZE = 1000
+MAX_WORKERS = 8
+
+_DONE = object()
+
+
+def _rangetables(ratingminvalue, ratingmaxvalue, openconnection):
+    # Only the range partitions whose interval overlaps [ratingminvalue, ratingmaxvalue]
+    catalog = Interface.getcatalog('range', openconnection)
+    if catalog is not None:
+        bounds, prefix = catalog['boundaries'], catalog['prefix']
+    else:
+        numberofpartitions = Interface.count_partitions(RANGE_TABLE_PREFIX, openconnection)
+        if numberofpartitions == 0:
+            return []
+        bounds, prefix = Interface._rangebounds(numberofpartitions), RANGE_TABLE_PREFIX
+
+    tables = []
+    lower = None
+    for i, upper in enumerate(bounds):
+        # Partition 0 is [0, b0]; every later one is (b(i-1), bi]
+        above = ratingmaxvalue >= 0 if lower is None else ratingmaxvalue > lower
+        if above and ratingminvalue <= upper:
+            tables.append(prefix + str(i))
+        lower = upper
+    return tables
+
+
+def _roundrobintables(openconnection):
+    # Round robin placement ignores the rating, so every partition has to be visited
+    catalog = Interface.getcatalog('roundrobin', openconnection)
+    if catalog is not None:
+        numberofpartitions, prefix = catalog['numberofpartitions'], catalog['prefix']
+    else:
+        numberofpartitions = Interface.count_partitions(RROBIN_TABLE_PREFIX, openconnection)
+        prefix = RROBIN_TABLE_PREFIX
+    return [prefix + str(i) for i in range(numberofpartitions)]
+
+
+def _scanworker(connectionfactory, tables, where, params, results, stop):
+    con = None
+    try:
+        con = connectionfactory()
+        cur = statementProfiler.cursor(con)
+        for tablename in tables:
+            if stop.is_set():
+                break
+            cur.execute("SELECT userid, movieid, rating FROM " + tablename + " WHERE " + where, params)
+            while True:
+                rows = cur.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                if not stop.is_set():
+                    results.put([(tablename,) + tuple(row) for row in rows])
+        cur.close()
+    except Exception as e:
+        results.put(e)
+    finally:
+        if con is not None:
+            con.close()
+        results.put(_DONE)
+
+
+def _fanout(tables, where, params, openconnection, connectionfactory=None, maxworkers=MAX_WORKERS):
+    # Scans tables on parallel connections and yields rows as they arrive
+    if not tables:
+        return iter(())
+    connectionfactory = connectionfactory or Interface._connectionfactory(openconnection)
+    return _fanoutgroups([(connectionfactory, tables)], where, params, maxworkers)
+
+
+def _fanoutgroups(groups, where, params, maxworkers=MAX_WORKERS):
+    # groups: (connectionfactory, tables) per node; every node gets up to maxworkers scanning connections
+    results = queue.Queue(maxsize=2 * maxworkers)
+    stop = threading.Event()
+    workers = []
+    for connectionfactory, tables in groups:
+        numberofworkers = min(maxworkers, len(tables))
+        workers += [threading.Thread(target=statementProfiler.bind(_scanworker),
+                                     args=(connectionfactory, tables[i::numberofworkers], where, params, results,
+                                           stop))
+                    for i in range(numberofworkers)]
+    for worker in workers:
+        worker.start()
+
+    running = len(workers)
+    try:
+        while running:
+            item = results.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                for row in item:
+                    yield row
+    finally:
+        # Closed early or failed: let the workers finish without blocking on a full queue
+        stop.set()
+        while running:
+            if results.get() is _DONE:
+                running -= 1
+        for worker in workers:
+            worker.join()
+
+
+def rangequery(ratingminvalue, ratingmaxvalue, openconnection, connectionfactory=None):
+    """
+    Streams every rating with ratingminvalue <= rating <= ratingmaxvalue
+    :return: Generator of (partition name, userid, movieid, rating)
+    """
+    where = "rating >= %s AND rating <= %s"
+    params = (ratingminvalue, ratingmaxvalue)
+    tables = _rangetables(ratingminvalue, ratingmaxvalue, openconnection) + _roundrobintables(openconnection)
+    return _fanout(tables, where, params, openconnection, connectionfactory)
+
+
+def hashlookup(key, openconnection):
+    """
+    Streams every rating whose hash partitioning column equals key, reading only the one fragment holding it
+    :return: Generator of (partition name, userid, movieid, rating)
+    """
+    prefix, numberofpartitions, position = Interface._hashtarget(openconnection)
+    tablename = prefix + str(Interface._hashindex(key, numberofpartitions))
+    column = Interface.HASH_COLUMNS[position]
+    cur = statementProfiler.cursor(openconnection)
+    try:
+        cur.execute("SELECT userid, movieid, rating FROM " + tablename + " WHERE " + column + " = %s", (key,))
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield (tablename,) + tuple(row)
+    finally:
+        cur.close()
+
+
+def pointquery(ratingvalue, openconnection, connectionfactory=None):
+    """
+    Streams every rating equal to ratingvalue
+    :return: Generator of (partition name, userid, movieid, rating)
+    """
+    where = "rating = %s"
+    params = (ratingvalue,)
+    tables = _rangetables(ratingvalue, ratingvalue, openconnection) + _roundrobintables(openconnection)
+    return _fanout(tables, where, params, openconnection, connectionfactory)
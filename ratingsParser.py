@@ -0,0 +1,103 @@
+#
+# Memory-mapped parser for userid::movieid::rating::timestamp files into compact typed arrays
+#
+import bisect
+import mmap
+import os
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def _chunkbounds(mapped, chunkbytes):
+    # (start, end) offsets into the mapped file that begin and end on line boundaries
+    size = len(mapped)
+    start = 0
+    while start < size:
+        end = mapped.find(b'\n', min(start + chunkbytes, size) - 1)
+        end = size if end < 0 else end + 1
+        yield start, end
+        start = end
+
+
+def parsebytes(data):
+    """
+    Parses a block of whole lines
+    :return: (userids, movieids, ratings) as int32/int32/float32 NumPy arrays, or array('i')/array('i')/array('f')
+             when NumPy is not installed
+    """
+    data = data.replace(b'::', b' ')
+    if numpy is not None:
+        values = numpy.fromstring(data, dtype=numpy.float64, sep=' ')
+        if values.size % 4:
+            raise ValueError('Ratings data does not have 4 fields on every line')
+        values = values.reshape(-1, 4)
+        return (values[:, 0].astype(numpy.int32), values[:, 1].astype(numpy.int32),
+                values[:, 2].astype(numpy.float32))
+
+    fields = data.split()
+    if len(fields) % 4:
+        raise ValueError('Ratings data does not have 4 fields on every line')
+    return (array('i', map(int, fields[0::4])), array('i', map(int, fields[1::4])),
+            array('f', map(float, fields[2::4])))
+
+
+def parsechunks(ratingsfilepath, chunkbytes=CHUNK_BYTES):
+    """
+    Memory-maps the file and parses it chunk by chunk, so only one chunk of text is held at a time
+    :return: Generator of (userids, movieids, ratings) arrays, see parsebytes
+    """
+    if os.path.getsize(ratingsfilepath) == 0:
+        return
+    with open(ratingsfilepath, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for start, end in _chunkbounds(mapped, chunkbytes):
+                yield parsebytes(mapped[start:end])
+        finally:
+            mapped.close()
+
+
+def parserange(ratingsfilepath, start, end):
+    with open(ratingsfilepath, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return parsebytes(mapped[start:end])
+        finally:
+            mapped.close()
+
+
+def slices(columns, size):
+    """
+    Splits one parsed chunk into column tuples of at most size rows; NumPy slices are views, not copies
+    """
+    userids, movieids, ratings = columns
+    for i in range(0, len(userids), size):
+        yield userids[i:i + size], movieids[i:i + size], ratings[i:i + size]
+
+
+def rows(columns):
+    """
+    Turns one parsed chunk into a list of (userid, movieid, rating) tuples for executemany
+    """
+    userids, movieids, ratings = columns
+    return list(zip(userids.tolist(), movieids.tolist(), ratings.tolist()))
+
+
+def rangeindexes(ratings, bounds):
+    """
+    Range partition index of every rating, by binary search over the partition upper bounds.
+    Ratings outside [0, bounds[-1]] get -1.
+    """
+    if numpy is not None:
+        ratings = numpy.asarray(ratings, dtype=numpy.float64)
+        indexes = numpy.searchsorted(numpy.asarray(bounds, dtype=numpy.float64), ratings, side='left')
+        indexes[(ratings < 0) | (ratings > bounds[-1])] = -1
+        return indexes
+    return array('i', [bisect.bisect_left(bounds, rating) if 0 <= rating <= bounds[-1] else -1
+                       for rating in ratings])
@@ -0,0 +1,212 @@
+#
+# Statement-level profiling for the Interface functions
+#
+import contextlib
+import functools
+import json
+import re
+import threading
+import time
+
+PARTITION_PATTERN = re.compile(r'\b((?:range|rrobin|hash)_part\d+)\b')
+
+_active = None
+
+
+class ProfiledCursor(object):
+    """
+    Cursor wrapper that reports every execute/executemany to the active profiler
+    """
+
+    def __init__(self, cursor, profiler):
+        self._cursor = cursor
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def execute(self, operation, params=None):
+        start = time.time()
+        try:
+            return self._cursor.execute(operation, params) if params is not None else self._cursor.execute(operation)
+        finally:
+            self._profiler.record(operation, time.time() - start, self._cursor.rowcount)
+
+    def executemany(self, operation, seq_params):
+        start = time.time()
+        try:
+            return self._cursor.executemany(operation, seq_params)
+        finally:
+            self._profiler.record(operation, time.time() - start, self._cursor.rowcount)
+
+
+class Profiler(object):
+    """
+    Collects statement latency, rows affected and target partition, grouped by the outermost Interface call.
+    Use as a context manager; while it is active every cursor from statementProfiler.cursor is profiled.
+    Calls on different threads are summarized apart; worker threads started through bind count towards
+    the call that started them.
+    :param path: File that receives one JSON line per finished call
+    :param callback: Called with the summary dict of every finished call
+    :param keepstatements: Also keep the individual statement records in each summary
+    """
+
+    def __init__(self, path=None, callback=None, keepstatements=False):
+        self.path = path
+        self.callback = callback
+        self.keepstatements = keepstatements
+        self.summaries = []
+        self._lock = threading.Lock()
+        # Each thread tracks its own outermost call; workers join one through attach
+        self._local = threading.local()
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active
+        _active = self._previous
+
+    def currentcall(self):
+        return getattr(self._local, 'call', None)
+
+    def startcall(self, name):
+        # Nested calls (rangeinsert -> rangeinsert_many) count towards the outermost call of their thread
+        depth = getattr(self._local, 'depth', 0) + 1
+        self._local.depth = depth
+        if depth > 1:
+            return False
+        self._local.call = {'call': name, 'start': time.time(), 'statements': []}
+        return True
+
+    def endcall(self, outermost):
+        self._local.depth -= 1
+        if not outermost:
+            return
+        call, self._local.call = self._local.call, None
+        summary = self._summarize(call, time.time() - call['start'])
+        with self._lock:
+            self.summaries.append(summary)
+        if self.path:
+            with self._lock, open(self.path, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+        if self.callback:
+            self.callback(summary)
+
+    @contextlib.contextmanager
+    def attach(self, call):
+        """
+        Counts the statements of this thread, and of any calls it makes, towards call from another thread
+        """
+        previous = (getattr(self._local, 'call', None), getattr(self._local, 'depth', 0))
+        self._local.call, self._local.depth = call, previous[1] + 1
+        try:
+            yield
+        finally:
+            self._local.call, self._local.depth = previous
+
+    def record(self, operation, seconds, rows):
+        match = PARTITION_PATTERN.search(operation)
+        statement = {
+            'statement': operation,
+            'seconds': seconds,
+            'rows': rows if rows is not None and rows >= 0 else None,
+            'partition': match.group(1) if match else None
+        }
+        call = self.currentcall()
+        with self._lock:
+            if call is not None:
+                call['statements'].append(statement)
+            else:
+                self.summaries.append(self._summarize({'call': None, 'statements': [statement]}, seconds))
+
+    def _summarize(self, call, elapsed):
+        statements = call['statements']
+        statementseconds = sum(s['seconds'] for s in statements)
+        partitions = {}
+        for s in statements:
+            if s['partition'] is None:
+                continue
+            p = partitions.setdefault(s['partition'], {'statements': 0, 'seconds': 0.0, 'rows': 0})
+            p['statements'] += 1
+            p['seconds'] += s['seconds']
+            p['rows'] += s['rows'] or 0
+        for p in partitions.values():
+            p['share'] = p['seconds'] / statementseconds if statementseconds else 0.0
+        summary = {
+            'call': call['call'],
+            'statements': len(statements),
+            'seconds': elapsed,
+            'statement_seconds': statementseconds,
+            'rows': sum(s['rows'] or 0 for s in statements),
+            'partitions': partitions
+        }
+        if self.keepstatements:
+            summary['statement_log'] = statements
+        return summary
+
+
+def profile(path=None, callback=None, keepstatements=False):
+    return Profiler(path, callback, keepstatements)
+
+
+def cursor(connection, **kwargs):
+    # With no active profiler this is just connection.cursor()
+    if _active is None:
+        return connection.cursor(**kwargs)
+    return ProfiledCursor(connection.cursor(**kwargs), _active)
+
+
+def instrumented(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profiler = _active
+        if profiler is None:
+            return function(*args, **kwargs)
+        outermost = profiler.startcall(function.__name__)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.endcall(outermost)
+    return wrapper
+
+
+def bind(function):
+    """
+    Wraps function so that, run on a worker thread, its statements count towards the caller's current call.
+    Call bind on the thread making the call, e.g. threading.Thread(target=bind(worker)).
+    """
+    profiler = _active
+    call = profiler.currentcall() if profiler is not None else None
+    if call is None:
+        return function
+
+    @functools.wraps(function)
+    def attached(*args, **kwargs):
+        with profiler.attach(call):
+            return function(*args, **kwargs)
+    return attached
+
+
+def formatsummary(summary):
+    """
+    One-line description, e.g. "rangepartition took 12 statements, 3.4 s, 80% in range_part3"
+    """
+    text = '{0} took {1} statements, {2:.3g} s'.format(summary['call'], summary['statements'], summary['seconds'])
+    if summary['partitions']:
+        name, hottest = max(summary['partitions'].items(), key=lambda item: item[1]['seconds'])
+        text += ', {0:.0f}% in {1}'.format(100 * hottest['share'], name)
+    return text
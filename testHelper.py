@@ -1,11 +1,17 @@
 import traceback
-import mysql.connector
+from concurrent.futures import ThreadPoolExecutor
+
+import connectionPool
 
 RANGE_TABLE_PREFIX = 'range_part'
 RROBIN_TABLE_PREFIX = 'rrobin_part'
 USER_ID_COLNAME = 'userid'
 MOVIE_ID_COLNAME = 'movieid'
 RATING_COLNAME = 'rating'
+# 60-bit row fingerprint; summed per table it identifies the multiset of rows.
+# The cast keeps SUM() in exact DECIMAL arithmetic instead of DOUBLE.
+ROW_FINGERPRINT = "CAST(CONV(LEFT(MD5(CONCAT_WS('#', userid, movieid, rating)), 15), 16, 10) AS UNSIGNED)"
+MAX_VALIDATION_WORKERS = 8
 
 # SETUP Functions
 def createdb(dbname):
@@ -52,37 +58,27 @@ def deleteAllPublicTables(openconnection):
     cur.close()
 
 
-def getopenconnection(user='root', password='123456', dbname='mysql'):
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='123456',
-        database=dbname
-    )
+def getopenconnection(user=None, password=None, dbname='mysql'):
+    return connectionPool.getconnection(user, password, dbname)
 
 ####### Tester support
 def getCountrangepartition(ratingstablename, numberofpartitions, openconnection):
     """
-    Get number of rows for each partition
+    Get number of rows for each partition, in a single scan of the ratings table
     """
     cur = openconnection.cursor()
-    countList = []
     interval = 5.0 / numberofpartitions
-    
-    # For first partition
-    cur.execute("SELECT COUNT(*) FROM " + ratingstablename + " WHERE rating >= %s AND rating <= %s", 
-                (0, interval))
-    countList.append(int(cur.fetchone()[0]))
+    conditions = ["SUM(rating >= %s AND rating <= %s)"]
+    params = [0, interval]
 
-    # For remaining partitions
     lowerbound = interval
     for i in range(1, numberofpartitions):
-        cur.execute("SELECT COUNT(*) FROM " + ratingstablename + 
-                   " WHERE rating > %s AND rating <= %s",
-                   (lowerbound, lowerbound + interval))
+        conditions.append("SUM(rating > %s AND rating <= %s)")
+        params.extend([lowerbound, lowerbound + interval])
         lowerbound += interval
-        countList.append(int(cur.fetchone()[0]))
 
+    cur.execute("SELECT " + ", ".join(conditions) + " FROM " + ratingstablename, params)
+    countList = [int(count or 0) for count in cur.fetchone()]
     cur.close()
     return countList
 
@@ -128,32 +124,71 @@ def totalrowsinallpartitions(cur, n, rangepartitiontableprefix, partitionstartin
     return count
 
 
-def testrangeandrobinpartitioning(n, openconnection, rangepartitiontableprefix, partitionstartindex, ACTUAL_ROWS_IN_INPUT_FILE):
+def tablefingerprint(openconnection, tablename):
+    """
+    Row count and summed row fingerprint of one table, read in a single pass
+    """
+    with openconnection.cursor() as cur:
+        cur.execute("SELECT COUNT(*), COALESCE(SUM(" + ROW_FINGERPRINT + "), 0) FROM " + tablename)
+        count, fingerprint = cur.fetchone()
+    return int(count), int(fingerprint)
+
+
+def _fingerprintworker(pool, tablename):
+    con = pool.getconnection()
+    try:
+        return tablefingerprint(con, tablename)
+    finally:
+        con.close()
+
+
+def validatepartitions(ratingstablename, n, openconnection, prefix, partitionstartindex):
+    """
+    Reads the count and fingerprint of every partition and of the ratings table once, in parallel
+    :return: (per-partition counts, total partition rows, partitions fingerprint, ratings rows, ratings fingerprint)
+    """
+    tables = ['{0}{1}'.format(prefix, i) for i in range(partitionstartindex, n + partitionstartindex)]
+    connections = connectionPool.poolof(openconnection)
+    with ThreadPoolExecutor(max_workers=min(MAX_VALIDATION_WORKERS, len(tables) + 1)) as pool:
+        results = list(pool.map(lambda tablename: _fingerprintworker(connections, tablename),
+                                tables + [ratingstablename]))
+    mastercount, masterfingerprint = results.pop()
+    counts = [count for count, _ in results]
+    return counts, sum(counts), sum(fp for _, fp in results), mastercount, masterfingerprint
+
+
+def testrangeandrobinpartitioning(n, openconnection, rangepartitiontableprefix, partitionstartindex, ACTUAL_ROWS_IN_INPUT_FILE,
+                                  ratingstablename='ratings'):
+    """
+    Checks the partition count, then completeness, disjointness and reconstruction from one parallel pass
+    :return: Per-partition row counts, or None when n is invalid
+    """
     with openconnection.cursor() as cur:
         if not isinstance(n, int) or n < 0:
             # Test 1: Check the number of tables created, if 'n' is invalid
             checkpartitioncount(cur, 0, rangepartitiontableprefix)
-        else:
-            # Test 2: Check the number of tables created, if all args are correct
-            checkpartitioncount(cur, n, rangepartitiontableprefix)
+            return None
+        # Test 2: Check the number of tables created, if all args are correct
+        checkpartitioncount(cur, n, rangepartitiontableprefix)
+
+    counts, count, fingerprint, mastercount, masterfingerprint = validatepartitions(
+        ratingstablename, n, openconnection, rangepartitiontableprefix, partitionstartindex)
 
-            # Test 3: Test Completeness by SQL UNION ALL Magic
-            count = totalrowsinallpartitions(cur, n, rangepartitiontableprefix, partitionstartindex)
-            if count < ACTUAL_ROWS_IN_INPUT_FILE: raise Exception(
-                "Completeness property of Partitioning failed. Excpected {0} rows after merging all tables, but found {1} rows".format(
-                    ACTUAL_ROWS_IN_INPUT_FILE, count))
+    # Test 3: Test Completeness by row count
+    if count < ACTUAL_ROWS_IN_INPUT_FILE: raise Exception(
+        "Completeness property of Partitioning failed. Excpected {0} rows after merging all tables, but found {1} rows".format(
+            ACTUAL_ROWS_IN_INPUT_FILE, count))
 
-            # Test 4: Test Disjointness by SQL UNION Magic
-            count = totalrowsinallpartitions(cur, n, rangepartitiontableprefix, partitionstartindex)
-            if count > ACTUAL_ROWS_IN_INPUT_FILE: raise Exception(
-                "Dijointness property of Partitioning failed. Excpected {0} rows after merging all tables, but found {1} rows".format(
-                    ACTUAL_ROWS_IN_INPUT_FILE, count))
+    # Test 4: Test Disjointness by row count
+    if count > ACTUAL_ROWS_IN_INPUT_FILE: raise Exception(
+        "Dijointness property of Partitioning failed. Excpected {0} rows after merging all tables, but found {1} rows".format(
+            ACTUAL_ROWS_IN_INPUT_FILE, count))
 
-            # Test 5: Test Reconstruction by SQL UNION Magic
-            count = totalrowsinallpartitions(cur, n, rangepartitiontableprefix, partitionstartindex)
-            if count != ACTUAL_ROWS_IN_INPUT_FILE: raise Exception(
-                "Rescontruction property of Partitioning failed. Excpected {0} rows after merging all tables, but found {1} rows".format(
-                    ACTUAL_ROWS_IN_INPUT_FILE, count))
+    # Test 5: Test Reconstruction by row fingerprints; a duplicated row hiding a missing one changes the sum
+    if count != mastercount or fingerprint != masterfingerprint: raise Exception(
+        "Rescontruction property of Partitioning failed. Merging all tables does not give back the {0} rows of {1} (rows duplicated or missing)".format(
+            mastercount, ratingstablename))
+    return counts
 
 
 def testrangerobininsert(expectedtablename, itemid, openconnection, rating, userid):
@@ -168,28 +203,35 @@ def testrangerobininsert(expectedtablename, itemid, openconnection, rating, user
         if count != 1:  return False
         return True
 
-def testEachRangePartition(ratingstablename, n, openconnection, rangepartitiontableprefix):
+def testEachRangePartition(ratingstablename, n, openconnection, rangepartitiontableprefix, counts=None):
     countList = getCountrangepartition(ratingstablename, n, openconnection)
-    cur = openconnection.cursor()
+    if counts is None:
+        counts = _partitioncounts(n, openconnection, rangepartitiontableprefix)
     for i in range(0, n):
-        cur.execute("select count(*) from {0}{1}".format(rangepartitiontableprefix, i))
-        count = int(cur.fetchone()[0])
-        if count != countList[i]:
+        if counts[i] != countList[i]:
             raise Exception("{0}{1} has {2} of rows while the correct number should be {3}".format(
-                rangepartitiontableprefix, i, count, countList[i]
+                rangepartitiontableprefix, i, counts[i], countList[i]
             ))
 
-def testEachRoundrobinPartition(ratingstablename, n, openconnection, roundrobinpartitiontableprefix):
+def testEachRoundrobinPartition(ratingstablename, n, openconnection, roundrobinpartitiontableprefix, counts=None):
     countList = getCountroundrobinpartition(ratingstablename, n, openconnection)
-    cur = openconnection.cursor()
+    if counts is None:
+        counts = _partitioncounts(n, openconnection, roundrobinpartitiontableprefix)
     for i in range(0, n):
-        cur.execute("select count(*) from {0}{1}".format(roundrobinpartitiontableprefix, i))
-        count = cur.fetchone()[0]
-        if count != countList[i]:
+        if counts[i] != countList[i]:
             raise Exception("{0}{1} has {2} of rows while the correct number should be {3}".format(
-                roundrobinpartitiontableprefix, i, count, countList[i]
+                roundrobinpartitiontableprefix, i, counts[i], countList[i]
             ))
 
+def _partitioncounts(n, openconnection, prefix):
+    cur = openconnection.cursor()
+    counts = []
+    for i in range(0, n):
+        cur.execute("select count(*) from {0}{1}".format(prefix, i))
+        counts.append(int(cur.fetchone()[0]))
+    cur.close()
+    return counts
+
 # ##########
 
 def testloadratings(MyAssignment, ratingstablename, filepath, openconnection, rowsininpfile):
@@ -228,8 +270,11 @@ def testrangepartition(MyAssignment, ratingstablename, n, openconnection, partit
 
     try:
         MyAssignment.rangepartition(ratingstablename, n, openconnection)
-        testrangeandrobinpartitioning(n, openconnection, RANGE_TABLE_PREFIX, partitionstartindex, ACTUAL_ROWS_IN_INPUT_FILE)
-        testEachRangePartition(ratingstablename, n, openconnection, RANGE_TABLE_PREFIX)
+        counts = testrangeandrobinpartitioning(n, openconnection, RANGE_TABLE_PREFIX, partitionstartindex,
+                                               ACTUAL_ROWS_IN_INPUT_FILE, ratingstablename)
+        if counts is not None:
+            testEachRangePartition(ratingstablename, n, openconnection, RANGE_TABLE_PREFIX,
+                                   counts if partitionstartindex == 0 else None)
         return [True, None]
     except Exception as e:
         traceback.print_exc()
@@ -248,8 +293,11 @@ def testroundrobinpartition(MyAssignment, ratingstablename, numberofpartitions,
     """
     try:
         MyAssignment.roundrobinpartition(ratingstablename, numberofpartitions, openconnection)
-        testrangeandrobinpartitioning(numberofpartitions, openconnection, RROBIN_TABLE_PREFIX, partitionstartindex, ACTUAL_ROWS_IN_INPUT_FILE)
-        testEachRoundrobinPartition(ratingstablename, numberofpartitions, openconnection, RROBIN_TABLE_PREFIX)
+        counts = testrangeandrobinpartitioning(numberofpartitions, openconnection, RROBIN_TABLE_PREFIX, partitionstartindex,
+                                               ACTUAL_ROWS_IN_INPUT_FILE, ratingstablename)
+        if counts is not None:
+            testEachRoundrobinPartition(ratingstablename, numberofpartitions, openconnection, RROBIN_TABLE_PREFIX,
+                                        counts if partitionstartindex == 0 else None)
     except Exception as e:
         traceback.print_exc()
         return [False, e]
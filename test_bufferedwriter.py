@@ -0,0 +1,172 @@
+#
+# Buffered writer with its inserts stubbed out; no MySQL server needed
+#
+import threading
+import time
+import unittest
+from unittest import mock
+
+import bufferedWriter
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingInsert(object):
+    # Stands in for rangeinsert_many/roundrobininsert_many, one call per committed batch
+
+    def __init__(self):
+        self.batches = []
+        self.fail = None
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, ratingstablename, rows, openconnection):
+        self.release.wait()
+        if self.fail is not None:
+            raise self.fail
+        self.batches.append(list(rows))
+
+    @property
+    def rows(self):
+        return [row for batch in self.batches for row in batch]
+
+
+class BufferedWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.insert = RecordingInsert()
+        patcher = mock.patch.dict(bufferedWriter._INSERTS, {'roundrobin': self.insert})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = FakeConnection()
+
+    def writer(self, durability, **kwargs):
+        writer = bufferedWriter.BufferedWriter('ratings', None, scheme='roundrobin', durability=durability,
+                                               connectionfactory=lambda: self.connection, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_sync_inserts_every_call(self):
+        writer = self.writer(bufferedWriter.SYNC)
+        writer.insert(1, 2, 3.0)
+        writer.insert_many([(4, 5, 1.0), (6, 7, 2.0)])
+        self.assertEqual(self.insert.batches, [[(1, 2, 3.0)], [(4, 5, 1.0), (6, 7, 2.0)]])
+
+    def test_sync_raises_straight_away(self):
+        writer = self.writer(bufferedWriter.SYNC)
+        self.insert.fail = RuntimeError("insert failed")
+        with self.assertRaises(RuntimeError):
+            writer.insert(1, 2, 3.0)
+
+    def test_group_returns_once_committed(self):
+        writer = self.writer(bufferedWriter.GROUP, maxdelay=0.05)
+        writer.insert(1, 2, 3.0)
+        self.assertEqual(self.insert.rows, [(1, 2, 3.0)])
+
+    def test_group_callers_share_a_batch(self):
+        writer = self.writer(bufferedWriter.GROUP, maxrows=4, maxdelay=5)
+        threads = [threading.Thread(target=writer.insert, args=(i, i, 1.0)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(len(self.insert.batches), 1)
+        self.assertEqual(sorted(self.insert.rows), [(i, i, 1.0) for i in range(4)])
+
+    def test_group_error_reaches_every_caller_in_the_batch(self):
+        writer = self.writer(bufferedWriter.GROUP, maxrows=2, maxdelay=5)
+        self.insert.fail = RuntimeError("insert failed")
+        errors = []
+
+        def insert(i):
+            try:
+                writer.insert(i, i, 1.0)
+            except RuntimeError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=insert, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(len(errors), 2)
+
+    def test_async_returns_before_the_insert(self):
+        writer = self.writer(bufferedWriter.ASYNC, maxdelay=0)
+        self.insert.release.clear()
+        writer.insert(1, 2, 3.0)
+        self.assertEqual(self.insert.batches, [])
+        self.insert.release.set()
+        writer.flush()
+        self.assertEqual(self.insert.rows, [(1, 2, 3.0)])
+
+    def test_async_error_is_raised_by_the_next_call(self):
+        writer = self.writer(bufferedWriter.ASYNC, maxdelay=0)
+        self.insert.fail = RuntimeError("insert failed")
+        writer.insert(1, 2, 3.0)
+        deadline = time.time() + 2
+        while writer._error is None and time.time() < deadline:
+            time.sleep(0.001)
+        self.insert.fail = None
+        with self.assertRaises(RuntimeError):
+            writer.insert(4, 5, 1.0)
+        writer.insert(4, 5, 1.0)
+        writer.flush()
+        self.assertEqual(self.insert.rows, [(4, 5, 1.0)])
+
+    def test_flushes_at_maxrows(self):
+        writer = self.writer(bufferedWriter.ASYNC, maxrows=3, maxdelay=60)
+        writer.insert_many([(i, i, 1.0) for i in range(3)])
+        deadline = time.time() + 2
+        while not self.insert.batches and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(self.insert.batches, [[(i, i, 1.0) for i in range(3)]])
+
+    def test_flushes_after_maxdelay(self):
+        writer = self.writer(bufferedWriter.ASYNC, maxrows=100, maxdelay=0.05)
+        start = time.time()
+        writer.insert(1, 2, 3.0)
+        time.sleep(0.02)
+        self.assertEqual(self.insert.batches, [])
+        while not self.insert.batches and time.time() < start + 2:
+            time.sleep(0.001)
+        self.assertEqual(self.insert.rows, [(1, 2, 3.0)])
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_flush(self):
+        writer = self.writer(bufferedWriter.ASYNC, maxrows=100, maxdelay=60)
+        writer.insert_many([(1, 2, 3.0), (4, 5, 1.0)])
+        writer.flush()
+        self.assertEqual(self.insert.batches, [[(1, 2, 3.0), (4, 5, 1.0)]])
+
+    def test_close_flushes_pending_rows(self):
+        writer = self.writer(bufferedWriter.ASYNC, maxrows=100, maxdelay=60)
+        writer.insert(1, 2, 3.0)
+        writer.close()
+        self.assertEqual(self.insert.rows, [(1, 2, 3.0)])
+        self.assertTrue(self.connection.closed)
+        with self.assertRaises(ValueError):
+            writer.insert(4, 5, 1.0)
+
+    def test_with_block_closes(self):
+        with self.writer(bufferedWriter.ASYNC, maxrows=100, maxdelay=60) as writer:
+            writer.insert(1, 2, 3.0)
+        self.assertEqual(self.insert.rows, [(1, 2, 3.0)])
+        self.assertTrue(self.connection.closed)
+
+    def test_unknown_scheme_or_durability(self):
+        with self.assertRaises(ValueError):
+            bufferedWriter.BufferedWriter('ratings', None, scheme='hash', connectionfactory=FakeConnection)
+        with self.assertRaises(ValueError):
+            bufferedWriter.BufferedWriter('ratings', None, scheme='roundrobin', durability='never',
+                                          connectionfactory=FakeConnection)
+
+
+if __name__ == '__main__':
+    unittest.main()
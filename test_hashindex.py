@@ -0,0 +1,45 @@
+#
+# Jump consistent hash used for hash partitioning; pure Python, no MySQL server needed
+#
+import unittest
+
+import Interface
+
+KEYS = range(1, 20001)
+
+
+class HashIndexTest(unittest.TestCase):
+
+    def test_in_range_and_deterministic(self):
+        for n in (1, 2, 5, 8, 100):
+            buckets = [Interface._hashindex(key, n) for key in KEYS]
+            self.assertTrue(all(0 <= b < n for b in buckets))
+            self.assertEqual(buckets, [Interface._hashindex(key, n) for key in KEYS])
+
+    def test_one_partition(self):
+        self.assertEqual(set(Interface._hashindex(key, 1) for key in KEYS), {0})
+
+    def test_growing_only_moves_keys_into_new_buckets(self):
+        for old, new in ((1, 2), (5, 8), (8, 9), (3, 30)):
+            for key in KEYS:
+                before, after = Interface._hashindex(key, old), Interface._hashindex(key, new)
+                if after != before:
+                    self.assertGreaterEqual(after, old)
+
+    def test_growing_moves_the_expected_share(self):
+        moved = sum(Interface._hashindex(key, 5) != Interface._hashindex(key, 8) for key in KEYS)
+        self.assertAlmostEqual(moved / float(len(KEYS)), 3 / 8.0, delta=0.02)
+
+    def test_balanced(self):
+        counts = [0] * 8
+        for key in KEYS:
+            counts[Interface._hashindex(key, 8)] += 1
+        self.assertLess(Interface._skew(counts), 1.1)
+
+    def test_keys_outside_64_bits(self):
+        self.assertEqual(Interface._hashindex(-1, 7), Interface._hashindex(2 ** 64 - 1, 7))
+        self.assertEqual(Interface._hashindex(2 ** 64 + 5, 7), Interface._hashindex(5, 7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#
+# Equi-depth range boundaries; pure Python, no MySQL server needed
+#
+import unittest
+
+import Interface
+
+SKEWED = [(0.5, 10), (1.0, 10), (3.0, 500), (3.5, 1000), (4.0, 900), (5.0, 100)]
+
+
+class EquiDepthBoundsTest(unittest.TestCase):
+
+    def check(self, histogram, numberofpartitions):
+        bounds = Interface._equidepthbounds(histogram, numberofpartitions)
+        counts = Interface._histogramcounts(histogram, bounds)
+        self.assertEqual(len(bounds), numberofpartitions)
+        self.assertEqual(bounds, sorted(bounds))
+        self.assertEqual(bounds[-1], 5.0)
+        self.assertEqual(sum(counts), sum(count for _, count in histogram))
+        return bounds, counts
+
+    def test_cut_closest_to_target(self):
+        bounds, counts = self.check(SKEWED, 3)
+        self.assertEqual(bounds, [3.0, 3.5, 5.0])
+        self.assertEqual(counts, [520, 1000, 1000])
+
+    def test_no_empty_partition_while_values_remain(self):
+        bounds, counts = self.check(SKEWED, 5)
+        self.assertEqual(counts, [20, 500, 1000, 900, 100])
+        self.assertNotIn(0, counts)
+
+    def test_uniform_split(self):
+        histogram = [(0.5 * i, 100) for i in range(1, 11)]
+        for n in (1, 2, 5, 10):
+            bounds, counts = self.check(histogram, n)
+            self.assertEqual(counts, [1000 // n] * n)
+
+    def test_more_partitions_than_values(self):
+        bounds, counts = self.check([(2.0, 7), (4.5, 3)], 4)
+        self.assertEqual(counts[:2], [7, 3])
+        self.assertEqual(counts[2:], [0, 0])
+
+    def test_empty_table_gets_equal_width_bounds(self):
+        for n in (1, 3, 5):
+            bounds, counts = self.check([], n)
+            self.assertEqual(bounds, Interface._rangebounds(n))
+            self.assertEqual(counts, [0] * n)
+
+    def test_never_worse_than_equal_width(self):
+        for n in (2, 3, 4, 5, 6):
+            _, counts = self.check(SKEWED, n)
+            equalwidth = Interface._histogramcounts(SKEWED, Interface._rangebounds(n))
+            self.assertLessEqual(Interface._skew(counts), Interface._skew(equalwidth))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#
+# ratingsParser on both its NumPy and pure Python paths, and the parallel loader's file chunks;
+# no MySQL server needed
+#
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import Interface
+import ratingsParser
+
+LINES = [(1, 122, 5.0), (1, 185, 4.5), (12, 231, 4.0), (345, 292, 0.5), (67890, 316, 3.0)]
+DATA = b''.join(b'%d::%d::%s::838985046\n' % (u, m, str(r).encode()) for u, m, r in LINES)
+
+
+class ParserTests(object):
+    # Run once with NumPy (when installed) and once with it hidden
+
+    def parse(self, data):
+        columns = ratingsParser.parsebytes(data)
+        return ratingsParser.rows(columns)
+
+    def test_parsebytes(self):
+        self.assertEqual(self.parse(DATA), LINES)
+
+    def test_parsebytes_without_trailing_newline(self):
+        self.assertEqual(self.parse(DATA.rstrip(b'\n')), LINES)
+
+    def test_parsebytes_rejects_short_lines(self):
+        with self.assertRaises(ValueError):
+            ratingsParser.parsebytes(DATA + b'7::8::2.5\n')
+
+    def test_rows_are_plain_python_values(self):
+        row = self.parse(DATA)[0]
+        self.assertEqual([type(v) for v in row], [int, int, float])
+
+    def test_slices(self):
+        columns = ratingsParser.parsebytes(DATA)
+        parts = list(ratingsParser.slices(columns, 2))
+        self.assertEqual([len(part[0]) for part in parts], [2, 2, 1])
+        self.assertEqual([row for part in parts for row in ratingsParser.rows(part)], LINES)
+
+    def test_rangeindexes_match_rangeindex(self):
+        ratings = [0.0, 0.5, 1.0, 1.25, 2.5, 2.75, 5.0, -0.5, 5.5]
+        for n in (1, 3, 4, 7):
+            bounds = Interface._rangebounds(n)
+            expected = [-1 if Interface._rangeindex(r, bounds) is None else Interface._rangeindex(r, bounds)
+                        for r in ratings]
+            self.assertEqual(list(ratingsParser.rangeindexes(ratings, bounds)), expected)
+
+    def test_parsechunks_never_cuts_a_line(self):
+        with tempfile.NamedTemporaryFile(suffix='.dat', delete=False) as f:
+            f.write(DATA)
+        try:
+            for chunkbytes in range(1, len(DATA) + 2):
+                parsed = [row for columns in ratingsParser.parsechunks(f.name, chunkbytes)
+                          for row in ratingsParser.rows(columns)]
+                self.assertEqual(parsed, LINES)
+        finally:
+            os.remove(f.name)
+
+
+@unittest.skipIf(ratingsParser.numpy is None, "NumPy is not installed")
+class NumpyParserTest(ParserTests, unittest.TestCase):
+    pass
+
+
+class PurePythonParserTest(ParserTests, unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(ratingsParser, 'numpy', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_arrays_are_typed(self):
+        userids, movieids, ratings = ratingsParser.parsebytes(DATA)
+        self.assertEqual((userids.typecode, movieids.typecode, ratings.typecode), ('i', 'i', 'f'))
+
+
+class ChunkBoundsTest(unittest.TestCase):
+
+    def check(self, data, chunkbytes):
+        bounds = list(ratingsParser._chunkbounds(data, chunkbytes))
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[-1][1], len(data))
+        for (_, end), (start, _) in zip(bounds, bounds[1:]):
+            self.assertEqual(end, start)
+        for start, end in bounds[:-1]:
+            self.assertEqual(data[end - 1:end], b'\n')
+        return bounds
+
+    def test_every_chunk_ends_on_a_line(self):
+        for chunkbytes in range(1, len(DATA) + 2):
+            self.check(DATA, chunkbytes)
+
+    def test_last_line_without_newline(self):
+        data = DATA.rstrip(b'\n')
+        for chunkbytes in (1, 7, len(data)):
+            self.assertEqual(self.check(data, chunkbytes)[-1][1], len(data))
+
+    def test_one_chunk_when_it_fits(self):
+        self.assertEqual(self.check(DATA, len(DATA)), [(0, len(DATA))])
+
+    def test_empty(self):
+        self.assertEqual(list(ratingsParser._chunkbounds(b'', 10)), [])
+
+
+class FileChunksTest(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(suffix='.dat', delete=False) as f:
+            f.write(DATA)
+        self.path = f.name
+        self.addCleanup(os.remove, self.path)
+
+    def test_chunks_cover_the_file_on_line_boundaries(self):
+        for chunkbytes in range(1, len(DATA) + 2):
+            bounds = list(Interface._filechunks(self.path, chunkbytes))
+            self.assertEqual(bounds[0][0], 0)
+            self.assertEqual(bounds[-1][1], len(DATA))
+            for (_, end), (start, _) in zip(bounds, bounds[1:]):
+                self.assertEqual(end, start)
+            for start, end in bounds:
+                self.assertEqual(DATA[end - 1:end], b'\n')
+
+    def test_parser_processes_see_every_row_once(self):
+        for chunkbytes in (1, 10, 30, len(DATA)):
+            parsed = [row for start, end in Interface._filechunks(self.path, chunkbytes)
+                      for row in ratingsParser.rows(Interface._parsechunk((self.path, start, end)))]
+            self.assertEqual(parsed, LINES)
+
+    def test_empty_file(self):
+        with open(self.path, 'wb'):
+            pass
+        self.assertEqual(list(Interface._filechunks(self.path, 10)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
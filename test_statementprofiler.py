@@ -0,0 +1,160 @@
+#
+# Statement profiler with a stand-in connection; no MySQL server needed
+#
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import statementProfiler
+
+
+class FakeCursor(object):
+
+    def __init__(self):
+        self.rowcount = -1
+
+    def execute(self, operation, params=None):
+        self.rowcount = 2 if operation.startswith('INSERT') else -1
+
+    def executemany(self, operation, seq_params):
+        self.rowcount = len(list(seq_params))
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def cursor(self, **kwargs):
+        return FakeCursor()
+
+
+CON = FakeConnection()
+
+
+def statement(sql, params=None):
+    cur = statementProfiler.cursor(CON)
+    cur.execute(sql, params)
+    cur.close()
+
+
+@statementProfiler.instrumented
+def inner():
+    statement("INSERT INTO range_part1 (userid) VALUES (1)")
+
+
+@statementProfiler.instrumented
+def outer():
+    statement("SELECT 1")
+    inner()
+    inner()
+
+
+@statementProfiler.instrumented
+def withworkers(bound):
+    def work():
+        statement("INSERT INTO rrobin_part0 (userid) VALUES (1)")
+    workers = [threading.Thread(target=statementProfiler.bind(work) if bound else work) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_inactive_cursor_is_not_wrapped(self):
+        self.assertIsInstance(statementProfiler.cursor(CON), FakeCursor)
+
+    def test_nested_calls_count_towards_the_outermost(self):
+        with statementProfiler.profile() as profiler:
+            outer()
+        self.assertEqual(len(profiler.summaries), 1)
+        summary = profiler.summaries[0]
+        self.assertEqual(summary['call'], 'outer')
+        self.assertEqual(summary['statements'], 3)
+        self.assertEqual(summary['rows'], 4)
+        self.assertEqual(summary['partitions']['range_part1']['statements'], 2)
+
+    def test_statements_outside_a_call(self):
+        with statementProfiler.profile() as profiler:
+            statement("SELECT 1")
+        self.assertEqual([s['call'] for s in profiler.summaries], [None])
+
+    def test_profiler_ends_with_its_block(self):
+        with statementProfiler.profile() as profiler:
+            pass
+        outer()
+        self.assertEqual(profiler.summaries, [])
+
+    def test_calls_on_other_threads_are_kept_apart(self):
+        start = threading.Barrier(4)
+
+        def run():
+            start.wait()
+            outer()
+        with statementProfiler.profile() as profiler:
+            threads = [threading.Thread(target=run) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual([s['statements'] for s in profiler.summaries], [3] * 4)
+
+    def test_bound_workers_join_the_caller(self):
+        with statementProfiler.profile() as profiler:
+            withworkers(bound=True)
+        self.assertEqual(len(profiler.summaries), 1)
+        self.assertEqual(profiler.summaries[0]['partitions']['rrobin_part0']['statements'], 3)
+
+    def test_unbound_workers_stay_apart(self):
+        with statementProfiler.profile() as profiler:
+            withworkers(bound=False)
+        calls = sorted((s['call'] or '', s['statements']) for s in profiler.summaries)
+        self.assertEqual(calls, [('', 1)] * 3 + [('withworkers', 0)])
+
+    def test_bind_without_profiler_returns_the_function(self):
+        self.assertIs(statementProfiler.bind(outer), outer)
+
+    def test_attach(self):
+        with statementProfiler.profile() as profiler:
+            call = {'call': 'elsewhere', 'statements': []}
+            with profiler.attach(call):
+                outer()
+            self.assertIsNone(profiler.currentcall())
+        self.assertEqual(len(call['statements']), 3)
+        self.assertEqual(profiler.summaries, [])
+
+    def test_path_and_callback(self):
+        seen = []
+        with tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False) as f:
+            path = f.name
+        self.addCleanup(os.remove, path)
+        with statementProfiler.profile(path=path, callback=seen.append, keepstatements=True):
+            outer()
+            inner()
+        with open(path) as f:
+            logged = [json.loads(line) for line in f]
+        self.assertEqual([s['call'] for s in logged], ['outer', 'inner'])
+        self.assertEqual(logged, seen)
+        self.assertEqual(len(seen[0]['statement_log']), 3)
+
+
+class FormatSummaryTest(unittest.TestCase):
+
+    def test_hottest_partition(self):
+        summary = {'call': 'rangepartition', 'statements': 12, 'seconds': 3.4,
+                   'partitions': {'range_part1': {'seconds': 0.2, 'share': 0.2},
+                                  'range_part3': {'seconds': 0.8, 'share': 0.8}}}
+        self.assertEqual(statementProfiler.formatsummary(summary),
+                         'rangepartition took 12 statements, 3.4 s, 80% in range_part3')
+
+    def test_no_partitions(self):
+        summary = {'call': 'getcatalog', 'statements': 1, 'seconds': 0.001, 'partitions': {}}
+        self.assertEqual(statementProfiler.formatsummary(summary), 'getcatalog took 1 statements, 0.001 s')
+
+
+if __name__ == '__main__':
+    unittest.main()